@@ -1,4 +1,8 @@
+import hashlib
+import hmac
 import re
+from django.conf import settings
+from django.core.cache import cache
 from rest_framework.authentication import BaseAuthentication
 from rest_framework.exceptions import AuthenticationFailed
 from .models import APIKey
@@ -19,13 +23,32 @@ class APIKeyAuthentication(BaseAuthentication):
 
         key = match.group(1)
 
-        # Check all active API keys
-        for api_key in APIKey.objects.filter(is_active=True):
+        if self.get_api_key(key) is None:
+            raise AuthenticationFailed("Invalid API key.")
+        return (None, key)  # valid key
+
+    def get_api_key(self, key):
+        # Keys verified recently skip the slow password hash. The row is still
+        # read, so deactivating or expiring a key takes effect immediately.
+        cache_key = self.cache_key(key)
+        cached = cache.get(cache_key)
+        if cached:
+            api_key = APIKey.objects.filter(pk=cached[0], hash=cached[1]).first()
+            if api_key and api_key.is_usable():
+                return api_key
+            cache.delete(cache_key)
+            return None
+
+        for api_key in APIKey.candidates(key):
             if api_key.check_key(key):
-                return (None, key)  # valid key
-
-        raise AuthenticationFailed("Invalid API key.")
-
+                cache.set(cache_key, (api_key.pk, api_key.hash), settings.API_KEY_CACHE_TTL)
+                return api_key
+        return None
+
+    @staticmethod
+    def cache_key(key):
+        digest = hmac.new(settings.SECRET_KEY.encode(), key.encode(), hashlib.sha256).hexdigest()
+        return f"api_key:verified:{digest}"
 
     def authenticate_header(self, request):
         return "Authorization"
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.4 on 2026-10-17 07:24
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api_key', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='apikey',
+            name='prefix',
+            field=models.CharField(editable=False, max_length=16, null=True, unique=True),
+        ),
+    ]
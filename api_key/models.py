@@ -13,6 +13,8 @@ def default_expiration() -> timezone:
 class APIKey(models.Model):
     name = models.CharField(max_length=128, unique=True)
     hash = models.CharField(max_length=128, unique=True)
+    # Public part of the key used to look it up; null for keys issued before prefixes
+    prefix = models.CharField(max_length=16, unique=True, null=True, editable=False)
     is_active = models.BooleanField(default=True)
     created_at = models.DateTimeField(auto_now_add=True)
     expires_on = models.DateTimeField(default=default_expiration)
@@ -27,15 +29,27 @@ class APIKey(models.Model):
     def create_key(name: str) -> str:
         """
         Generates a raw API key and saves its hash in the DB.
-        Returns the raw key (only shown once).
+        Returns the raw key (only shown once), formatted `<prefix>.<secret>`.
         """
-        secret_key = secrets.token_urlsafe(32)
+        prefix = secrets.token_hex(6)
+        secret_key = f"{prefix}.{secrets.token_urlsafe(32)}"
         hash = make_password(secret_key)
-        APIKey.objects.create(name=name, hash=hash)
+        APIKey.objects.create(name=name, hash=hash, prefix=prefix)
         return secret_key
 
+    @staticmethod
+    def candidates(raw_key: str):
+        """Active keys that could match a raw key: the one with its prefix, or all unprefixed keys."""
+        prefix, sep, _ = raw_key.partition(".")
+        if sep:
+            return APIKey.objects.filter(is_active=True, prefix=prefix)
+        return APIKey.objects.filter(is_active=True, prefix__isnull=True)
+
+    def is_usable(self) -> bool:
+        return self.is_active and not self.is_expired()
+
     def check_key(self, raw_key: str) -> bool:
-        return self.is_active and not self.is_expired() and check_password(raw_key, self.hash)
+        return self.is_usable() and check_password(raw_key, self.hash)
 
     def __str__(self):
         return f"API Key: {self.name}"
@@ -24,5 +24,5 @@ class APIKeyTable(tables.Table):
 
     class Meta:
         model = APIKey
-        fields = ("id", 'name', 'is_active', "created_at", 'expires_on', "edit", "delete")
+        fields = ("id", 'name', 'prefix', 'is_active', "created_at", 'expires_on', "edit", "delete")
         order_by = ("id",)
@@ -7,7 +7,11 @@ from rest_framework.permissions import IsAuthenticated
 
 from django.utils import timezone
 from datetime import timedelta
+from unittest import mock
+from django.contrib.auth.hashers import check_password, make_password
+from django.core.cache import cache
 
+from core.tests import LOCMEM_CACHES
 from .models import APIKey
 from .authentication import APIKeyAuthentication
 from .permissions import HasAPIKey
@@ -117,3 +121,60 @@ class APIKeyAuthTests(TestCase):
             HTTP_AUTHORIZATION=""
         )
         self.assertEqual(response.status_code, 401)
+
+
+@override_settings(ROOT_URLCONF=__name__, CACHES=LOCMEM_CACHES)
+class APIKeyLookupTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.raw_key = APIKey.create_key("lookup-key")
+        for i in range(3):
+            APIKey.create_key(f"other-key-{i}")
+
+    def tearDown(self):
+        cache.clear()
+
+    def get(self, key):
+        return self.client.get("/api/", HTTP_AUTHORIZATION=f"Bearer {key}")
+
+    def test_key_has_lookup_prefix(self):
+        prefix, secret = self.raw_key.split(".")
+        self.assertEqual(APIKey.objects.get(name="lookup-key").prefix, prefix)
+
+    def test_only_prefixed_key_is_hashed(self):
+        with mock.patch("api_key.models.check_password", wraps=check_password) as mock_check:
+            response = self.get(self.raw_key)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(mock_check.call_count, 1)
+
+    def test_unknown_prefix_is_not_hashed(self):
+        with mock.patch("api_key.models.check_password") as mock_check:
+            response = self.get("000000000000.notarealkey")
+        self.assertEqual(response.status_code, 401)
+        mock_check.assert_not_called()
+
+    def test_legacy_key_without_prefix_still_works(self):
+        legacy_key = "legacysecret"
+        APIKey.objects.create(name="legacy", hash=make_password(legacy_key))
+
+        self.assertEqual(self.get(legacy_key).status_code, 200)
+
+    def test_verified_key_skips_hash_on_repeat(self):
+        self.assertEqual(self.get(self.raw_key).status_code, 200)
+
+        with mock.patch("api_key.models.check_password") as mock_check:
+            self.assertEqual(self.get(self.raw_key).status_code, 200)
+        mock_check.assert_not_called()
+
+    def test_deactivation_applies_to_cached_key(self):
+        self.assertEqual(self.get(self.raw_key).status_code, 200)
+        APIKey.objects.filter(name="lookup-key").update(is_active=False)
+
+        self.assertEqual(self.get(self.raw_key).status_code, 401)
+
+    def test_expiry_applies_to_cached_key(self):
+        self.assertEqual(self.get(self.raw_key).status_code, 200)
+        APIKey.objects.filter(name="lookup-key").update(expires_on=timezone.now() - timedelta(seconds=1))
+
+        self.assertEqual(self.get(self.raw_key).status_code, 401)
@@ -1,8 +1,20 @@
+import hashlib
 import os
 
 CONTENT_BASE_PATH = ""
 CONTENT_RAW_PHOTOS_PATH = os.path.join(CONTENT_BASE_PATH, "raw_photos")
 CONTENT_RESIZED_PHOTOS_PATH = os.path.join(CONTENT_BASE_PATH, "processed_photos")
 
+
+def sharded_path(base, filename):
+    """Place a file two directories deep by the hash of its name, e.g. base/ab/cd/filename."""
+    digest = hashlib.md5(filename.encode()).hexdigest()
+    return os.path.join(base, digest[:2], digest[2:4], filename)
+
+
+def content_addressed_path(base, digest, ext):
+    """Name a file by the md5 of its bytes, so identical files share one path."""
+    return os.path.join(base, digest[:2], digest[2:4], f"{digest}{ext.lower()}")
+
 UI_THUMBNAIL_LARGE = "photoserv_ui_large"
 UI_THUMBNAIL_SMALL = "photoserv_ui_small"
@@ -134,7 +134,10 @@ PhotoFormSet = forms.modelformset_factory(
 class SizeForm(forms.ModelForm):
     class Meta:
         model = Size
-        fields = ["slug", "comment", "max_dimension", "square_crop", "public"]
+        fields = [
+            "slug", "comment", "max_dimension", "square_crop", "public", "draft_decode",
+            "output_format", "quality", "progressive", "optimize", "subsampling",
+        ]
 
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
@@ -0,0 +1,84 @@
+import os
+import shutil
+
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from core import CONTENT_RAW_PHOTOS_PATH, CONTENT_RESIZED_PHOTOS_PATH, sharded_path
+from core.models import Photo, PhotoSize
+
+
+class Command(BaseCommand):
+    help = (
+        "Move raw and processed photos stored flat in their content directory into the "
+        "sharded layout used for new files. Safe to interrupt and run again."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=500, help="Files moved per transaction.")
+        parser.add_argument("--dry-run", action="store_true", help="Report what would be moved without moving it.")
+
+    def handle(self, *args, batch_size, dry_run, **options):
+        for model, field, base in (
+            (Photo, "raw_image", CONTENT_RAW_PHOTOS_PATH),
+            (PhotoSize, "image", CONTENT_RESIZED_PHOTOS_PATH),
+        ):
+            moved = self.shard(model, field, base, batch_size, dry_run)
+            verb = "Would move" if dry_run else "Moved"
+            self.stdout.write(f"{verb} {moved} {model._meta.verbose_name} files.")
+
+    def shard(self, model, field, base, batch_size, dry_run):
+        moved = 0
+        last_id = 0
+        while True:
+            batch = list(
+                model.objects.filter(id__gt=last_id).order_by("id").values_list("id", field)[:batch_size]
+            )
+            if not batch:
+                return moved
+            last_id = batch[-1][0]
+
+            # Only files directly in the base directory still need moving
+            batch = [(pk, name) for pk, name in batch if name and os.path.dirname(name) == base]
+            if dry_run:
+                moved += len(batch)
+                continue
+            moved += self.move_batch(model, field, base, batch)
+
+    def move_batch(self, model, field, base, batch):
+        """
+        Hardlink each file into place, point the rows at the new names, then remove the old
+        names once that commits. An interruption leaves at most an extra link, never a row
+        pointing at a missing file.
+        """
+        updates = []
+        for pk, name in batch:
+            old_path = default_storage.path(name)
+            if not os.path.isfile(old_path):
+                self.stderr.write(f"Skipping {name}: file not found.")
+                continue
+
+            new_name = sharded_path(base, os.path.basename(name))
+            new_path = default_storage.path(new_name)
+            if os.path.exists(new_path) and not os.path.samefile(old_path, new_path):
+                new_name = default_storage.get_available_name(new_name)
+                new_path = default_storage.path(new_name)
+            os.makedirs(os.path.dirname(new_path), exist_ok=True)
+            if not os.path.exists(new_path):
+                try:
+                    os.link(old_path, new_path)
+                except OSError:
+                    shutil.copy2(old_path, new_path)
+            # A fresh mtime keeps the consistency check from taking the new name for a stray
+            # file before its row is updated
+            os.utime(new_path)
+            updates.append((pk, old_path, new_name))
+
+        with transaction.atomic():
+            for pk, _, new_name in updates:
+                model.objects.filter(pk=pk).update(**{field: new_name})
+
+        for _, old_path, _ in updates:
+            os.remove(old_path)
+        return len(updates)
@@ -0,0 +1,79 @@
+import atexit
+import os
+import threading
+
+import exiftool
+from celery.signals import worker_process_shutdown
+from exiftool.exceptions import ExifToolException
+
+
+# Restart ExifTool after this many files to bound its memory use
+EXIFTOOL_MAX_FILES = 1000
+
+_lock = threading.RLock()
+_helper = None
+_helper_pid = None
+_files_read = 0
+# Helpers inherited from a parent process; kept referenced so garbage collection
+# doesn't terminate the parent's ExifTool through the shared pipe
+_inherited = []
+
+
+def get_exiftool():
+    """
+    Return this process's ExifTool helper in -stay_open mode, starting it on first use
+    and restarting it if it died, was inherited across a fork, or has read too many files.
+    """
+    global _helper, _helper_pid, _files_read
+    with _lock:
+        if _helper is not None:
+            if _helper_pid != os.getpid():
+                _inherited.append(_helper)
+                _helper = None
+            elif not _helper.running or _files_read >= EXIFTOOL_MAX_FILES:
+                shutdown()
+
+        if _helper is None:
+            _helper = exiftool.ExifToolHelper(common_args=["-G"])
+            _helper.run()
+            _helper_pid = os.getpid()
+            _files_read = 0
+        return _helper
+
+
+def get_metadata(files, params=None):
+    """
+    Read metadata with the shared ExifTool. If the process crashes mid-read it is
+    restarted and the read retried once.
+    """
+    global _files_read
+    files = [files] if isinstance(files, (str, os.PathLike)) else list(files)
+
+    with _lock:
+        for attempt in range(2):
+            helper = get_exiftool()
+            try:
+                metadata = helper.get_metadata(files, params)
+            except ExifToolException:
+                if helper.running or attempt:
+                    raise
+                continue
+            _files_read += len(files)
+            return metadata
+
+
+def shutdown(**kwargs):
+    """Stop this process's ExifTool, if it owns one."""
+    global _helper
+    with _lock:
+        if _helper is not None and _helper_pid == os.getpid():
+            try:
+                if _helper.running:
+                    _helper.terminate()
+            except ExifToolException:
+                pass
+        _helper = None
+
+
+atexit.register(shutdown)
+worker_process_shutdown.connect(shutdown)
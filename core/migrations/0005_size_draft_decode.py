@@ -0,0 +1,18 @@
+# Generated by Django 5.2.4 on 2026-10-17 06:58
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0004_photo_publishing'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='size',
+            name='draft_decode',
+            field=models.BooleanField(default=True, help_text='Allow reduced-resolution JPEG decoding when this size is much smaller than the original.'),
+        ),
+    ]
@@ -0,0 +1,44 @@
+# Generated by Django 5.2.4 on 2026-10-17 07:01
+
+import django.core.validators
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0005_size_draft_decode'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='photosize',
+            name='format',
+            field=models.CharField(choices=[('JPEG', 'JPEG'), ('WEBP', 'WebP'), ('AVIF', 'AVIF')], default='JPEG', max_length=8),
+        ),
+        migrations.AddField(
+            model_name='size',
+            name='optimize',
+            field=models.BooleanField(default=False, help_text='Spend more time encoding for smaller files'),
+        ),
+        migrations.AddField(
+            model_name='size',
+            name='output_format',
+            field=models.CharField(choices=[('JPEG', 'JPEG'), ('WEBP', 'WebP'), ('AVIF', 'AVIF')], default='JPEG', max_length=8),
+        ),
+        migrations.AddField(
+            model_name='size',
+            name='progressive',
+            field=models.BooleanField(default=False, help_text='Progressive JPEG encoding'),
+        ),
+        migrations.AddField(
+            model_name='size',
+            name='quality',
+            field=models.PositiveSmallIntegerField(default=75, help_text='Encoder quality, 1-100', validators=[django.core.validators.MinValueValidator(1), django.core.validators.MaxValueValidator(100)]),
+        ),
+        migrations.AddField(
+            model_name='size',
+            name='subsampling',
+            field=models.CharField(blank=True, choices=[('', 'Encoder default'), ('4:4:4', '4:4:4 (best quality)'), ('4:2:2', '4:2:2'), ('4:2:0', '4:2:0 (smallest)')], default='', max_length=5),
+        ),
+    ]
@@ -0,0 +1,36 @@
+# Generated by Django 5.2.4 on 2026-10-17 07:03
+
+import hashlib
+import json
+from django.db import migrations, models
+
+
+# Frozen copy of Size.RENDER_FIELDS at the time of this migration
+RENDER_FIELDS = (
+    "max_dimension", "square_crop", "draft_decode",
+    "output_format", "quality", "progressive", "optimize", "subsampling",
+)
+
+
+def set_fingerprints(apps, schema_editor):
+    Size = apps.get_model('core', 'Size')
+    for size in Size.objects.all():
+        values = [getattr(size, field) for field in RENDER_FIELDS]
+        size.fingerprint = hashlib.sha256(json.dumps(values).encode()).hexdigest()
+        size.save(update_fields=['fingerprint'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0006_size_output_format'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='size',
+            name='fingerprint',
+            field=models.CharField(blank=True, default='', editable=False, max_length=64),
+        ),
+        migrations.RunPython(set_fingerprints, reverse_code=migrations.RunPython.noop),
+    ]
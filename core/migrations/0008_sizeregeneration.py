@@ -0,0 +1,30 @@
+# Generated by Django 5.2.4 on 2026-10-17 07:04
+
+import django.db.models.deletion
+import django.utils.timezone
+import uuid
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0007_size_fingerprint'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SizeRegeneration',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('run_id', models.UUIDField(default=uuid.uuid4)),
+                ('total', models.PositiveIntegerField(default=0)),
+                ('done', models.PositiveIntegerField(default=0)),
+                ('last_photo_id', models.PositiveBigIntegerField(default=0)),
+                ('started_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('updated_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('finished_at', models.DateTimeField(blank=True, null=True)),
+                ('size', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='regeneration', to='core.size')),
+            ],
+        ),
+    ]
@@ -0,0 +1,40 @@
+# Generated by Django 5.2.4 on 2026-10-17 07:08
+
+from django.db import migrations, models
+
+
+def set_size_fingerprints(apps, schema_editor):
+    # Existing renders match their size's current settings
+    PhotoSize = apps.get_model("core", "PhotoSize")
+    Size = apps.get_model("core", "Size")
+    PhotoSize.objects.update(
+        size_fingerprint=models.Subquery(
+            Size.objects.filter(pk=models.OuterRef("size_id")).values("fingerprint")[:1]
+        )
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0008_sizeregeneration'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='photo',
+            name='raw_md5',
+            field=models.CharField(blank=True, editable=False, max_length=32, null=True),
+        ),
+        migrations.AddField(
+            model_name='photosize',
+            name='size_fingerprint',
+            field=models.CharField(blank=True, default='', max_length=64),
+        ),
+        migrations.AddField(
+            model_name='photosize',
+            name='source_md5',
+            field=models.CharField(blank=True, max_length=32, null=True),
+        ),
+        migrations.RunPython(set_size_fingerprints, migrations.RunPython.noop),
+    ]
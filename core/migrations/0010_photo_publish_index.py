@@ -0,0 +1,17 @@
+# Generated by Django 5.2.4 on 2026-10-17 07:34
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0009_render_source_tracking'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='photo',
+            index=models.Index(fields=['hidden', 'publish_date', '_published'], name='core_photo_publish_idx'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.4 on 2026-10-17 08:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0010_photo_publish_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='sizeregeneration',
+            name='fingerprint',
+            field=models.CharField(blank=True, default='', max_length=64),
+        ),
+    ]
@@ -1,12 +1,19 @@
 from django.db import models
 import os
 import uuid
+import json
+import hashlib
+from contextlib import contextmanager
+from datetime import timedelta
+from django.conf import settings
 from django.urls import reverse
 from django.utils.text import slugify
-from . import CONTENT_RAW_PHOTOS_PATH, CONTENT_RESIZED_PHOTOS_PATH
+from . import CONTENT_RAW_PHOTOS_PATH, CONTENT_RESIZED_PHOTOS_PATH, sharded_path, content_addressed_path
 from . import tasks
 from django.core.exceptions import ValidationError
+from django.core.validators import MinValueValidator, MaxValueValidator
 from django.utils import timezone
+from PIL import features
 from .signals import photo_published, photo_unpublished
 
 
@@ -27,10 +34,12 @@ class PublicEntity(models.Model):
 class Photo(PublicEntity):
     def get_image_file_path(instance, filename):
         ext = os.path.splitext(filename)[1]
+        if settings.CONTENT_DEDUPLICATION and instance.raw_md5:
+            return content_addressed_path(CONTENT_RAW_PHOTOS_PATH, instance.raw_md5, ext)
         random_str = uuid.uuid4().hex[:8]
         kebab_title = slugify(instance.title)
         new_filename = f"{random_str}-{kebab_title}{ext}"
-        return os.path.join(CONTENT_RAW_PHOTOS_PATH, new_filename)
+        return sharded_path(CONTENT_RAW_PHOTOS_PATH, new_filename)
 
     title = models.CharField(max_length=255)
     slug = models.SlugField(max_length=255, unique=True)
@@ -39,6 +48,7 @@ class Photo(PublicEntity):
     publish_date = models.DateTimeField(default=timezone.now, blank=True, null=False)
     hidden = models.BooleanField(default=False, help_text="Hide from public API")
     _published = models.BooleanField(default=False, db_column="published")
+    raw_md5 = models.CharField(max_length=32, null=True, blank=True, editable=False)
 
     tags = models.ManyToManyField(
         "Tag",
@@ -46,6 +56,11 @@ class Photo(PublicEntity):
         related_name="photos"
     )
 
+    class Meta:
+        indexes = [
+            models.Index(fields=["hidden", "publish_date", "_published"], name="core_photo_publish_idx"),
+        ]
+
     @property
     def published(self):
         return self._published
@@ -62,6 +77,21 @@ class Photo(PublicEntity):
     
     def calculate_published(self) -> bool:
         return not self.hidden and bool(self.publish_date and self.publish_date <= timezone.now())
+
+    @staticmethod
+    def published_filter(now=None) -> models.Q:
+        """Query equivalent of calculate_published."""
+        return models.Q(hidden=False, publish_date__lte=now or timezone.now())
+
+    @staticmethod
+    def publish_transition_filter(now=None) -> models.Q:
+        """Photos whose stored published state differs from calculate_published."""
+        now = now or timezone.now()
+        return (
+            models.Q(_published=False, hidden=False, publish_date__lte=now)
+            | models.Q(_published=True, hidden=True)
+            | models.Q(_published=True, publish_date__gt=now)
+        )
     
     def update_published(self, update_model: bool = False, dispatch_signals: bool = False) -> bool:
         old = self._published
@@ -99,16 +129,57 @@ class Photo(PublicEntity):
         if not self.slug:
             self.slug = self.calculate_slug()
         is_new = self.pk is None
+        raw_replaced = False
+        schedule_changed = is_new
 
         if not is_new:
             # Recalculate published status on updates
             self.update_published(dispatch_signals=True)
-        super().save(*args, **kwargs)
+
+            old = Photo.objects.filter(pk=self.pk).values_list("raw_image", "publish_date", "hidden").first()
+            if old is not None:
+                old_raw, old_publish_date, old_hidden = old
+                # A replaced raw makes existing renders stale
+                raw_replaced = old_raw != self.raw_image.name
+                if raw_replaced:
+                    self.raw_md5 = None
+                schedule_changed = old_publish_date != self.publish_date or old_hidden != self.hidden
+
+        if settings.CONTENT_DEDUPLICATION and self.raw_image and not self.raw_image._committed:
+            with self._deduplicate_raw():
+                super().save(*args, **kwargs)
+        else:
+            super().save(*args, **kwargs)
 
         if schedule_followup_tasks and is_new:
             # Generate other sizes via Celery task
             tasks.post_photo_create.delay_on_commit(self.id)
+        elif raw_replaced:
+            tasks.generate_sizes_for_photo.delay_on_commit(self.id)
+
+        # Publish on time rather than at the next publish_photos run
+        if schedule_changed and not self._published:
+            tasks.schedule_publish(self)
     
+    @contextmanager
+    def _deduplicate_raw(self):
+        """
+        Point a new upload at the stored copy of identical bytes, or store it by its hash.
+        The content stays locked until the row referencing it is saved.
+        """
+        md5 = hashlib.md5()
+        for chunk in self.raw_image.chunks():
+            md5.update(chunk)
+        self.raw_md5 = md5.hexdigest()
+
+        ext = os.path.splitext(self.raw_image.name)[1]
+        name = content_addressed_path(CONTENT_RAW_PHOTOS_PATH, self.raw_md5, ext)
+        with tasks.content_lock(self.raw_md5):
+            if self.raw_image.storage.exists(name):
+                self.raw_image.name = name
+                self.raw_image._committed = True
+            yield
+
     def assign_albums(self, albums):
         # Remove unselected
         PhotoInAlbum.objects.filter(photo=self).exclude(album__in=albums).delete()
@@ -330,6 +401,40 @@ class PhotoInAlbum(models.Model):
 
 
 class Size(PublicEntity):
+    class OutputFormat(models.TextChoices):
+        JPEG = "JPEG", "JPEG"
+        WEBP = "WEBP", "WebP"
+        AVIF = "AVIF", "AVIF"
+
+    class Subsampling(models.TextChoices):
+        DEFAULT = "", "Encoder default"
+        S444 = "4:4:4", "4:4:4 (best quality)"
+        S422 = "4:2:2", "4:2:2"
+        S420 = "4:2:0", "4:2:0 (smallest)"
+
+    # Fields that change how a size is rendered
+    RENDER_FIELDS = (
+        "max_dimension", "square_crop", "draft_decode",
+        "output_format", "quality", "progressive", "optimize", "subsampling",
+    )
+
+    # Encoder settings; a size left at their defaults can serve a raw it wouldn't resize as-is
+    ENCODER_FIELDS = ("quality", "progressive", "optimize", "subsampling")
+
+    # Output format -> (file extension, content type)
+    OUTPUT_FORMAT_TYPES = {
+        OutputFormat.JPEG: (".jpg", "image/jpeg"),
+        OutputFormat.WEBP: (".webp", "image/webp"),
+        OutputFormat.AVIF: (".avif", "image/avif"),
+    }
+
+    # Output format -> Pillow feature name of its encoder
+    OUTPUT_FORMAT_FEATURES = {
+        OutputFormat.JPEG: "jpg",
+        OutputFormat.WEBP: "webp",
+        OutputFormat.AVIF: "avif",
+    }
+
     slug = models.CharField(max_length=32, unique=True)
     comment = models.CharField(max_length=255, blank=True, null=True)
     max_dimension = models.PositiveIntegerField()
@@ -337,6 +442,32 @@ class Size(PublicEntity):
     builtin = models.BooleanField(default=False)
     can_edit = models.BooleanField(default=True)
     public = models.BooleanField(default=True, help_text="Allow in the public API?")
+    draft_decode = models.BooleanField(
+        default=True,
+        help_text="Allow reduced-resolution JPEG decoding when this size is much smaller than the original."
+    )
+    output_format = models.CharField(max_length=8, choices=OutputFormat.choices, default=OutputFormat.JPEG)
+    quality = models.PositiveSmallIntegerField(
+        default=75,
+        validators=[MinValueValidator(1), MaxValueValidator(100)],
+        help_text="Encoder quality, 1-100"
+    )
+    progressive = models.BooleanField(default=False, help_text="Progressive JPEG encoding")
+    optimize = models.BooleanField(default=False, help_text="Spend more time encoding for smaller files")
+    subsampling = models.CharField(max_length=5, choices=Subsampling.choices, default=Subsampling.DEFAULT, blank=True)
+    fingerprint = models.CharField(max_length=64, blank=True, default="", editable=False)
+
+    @property
+    def extension(self) -> str:
+        return self.OUTPUT_FORMAT_TYPES[self.output_format][0]
+
+    @property
+    def content_type(self) -> str:
+        return self.OUTPUT_FORMAT_TYPES[self.output_format][1]
+
+    @property
+    def default_encoding(self) -> bool:
+        return all(getattr(self, field) == self._meta.get_field(field).default for field in self.ENCODER_FIELDS)
 
     def clean(self):
         # Prevent modifications to builtin sizes
@@ -347,18 +478,26 @@ class Size(PublicEntity):
             orig = Size.objects.get(pk=self.pk)
             if self.builtin and (self.slug != orig.slug or self.comment != orig.comment):
                 raise ValidationError("Cannot change the slug or comment of a builtin size.")
+        # Pillow may be built without some encoders
+        if not features.check(self.OUTPUT_FORMAT_FEATURES[self.output_format]):
+            raise ValidationError(f"{self.get_output_format_display()} output is not supported by this installation.")
 
-    def save(self, *args, **kwargs):
-        super().save(*args, **kwargs)
+    def calculate_fingerprint(self) -> str:
+        values = [getattr(self, field) for field in self.RENDER_FIELDS]
+        return hashlib.sha256(json.dumps(values).encode()).hexdigest()
 
-        file_paths = list(self.photos.values_list("image", flat=True))
-        self.photos.all().delete()
+    def save(self, *args, **kwargs):
+        # Only re-render when a field that affects rendering has changed
+        fingerprint = self.calculate_fingerprint()
+        render_changed = fingerprint != self.fingerprint
+        self.fingerprint = fingerprint
 
-        if file_paths:
-            tasks.delete_files.delay_on_commit(file_paths)
+        super().save(*args, **kwargs)
 
-        # Trigger task to regenerate photos for this size after DB commit
-        tasks.generate_photo_sizes_for_size.delay_on_commit(self.id)
+        # Existing renders stay in place, marked stale by the fingerprint change,
+        # until the regeneration replaces them or they are rendered on request
+        if render_changed and not settings.PHOTO_SIZE_LAZY_RENDERING:
+            tasks.generate_photo_sizes_for_size.delay_on_commit(self.id)
 
     # Disallow deleting a builtin size
     def delete(self, *args, **kwargs):
@@ -380,13 +519,42 @@ class Size(PublicEntity):
         ordering = ["max_dimension"]
 
 
+class SizeRegeneration(models.Model):
+    """Progress of re-rendering one size across the library, walked by photo id in chunks."""
+    size = models.OneToOneField(Size, on_delete=models.CASCADE, related_name="regeneration")
+    run_id = models.UUIDField(default=uuid.uuid4)
+    # The size's render fingerprint this run renders
+    fingerprint = models.CharField(max_length=64, blank=True, default="")
+    total = models.PositiveIntegerField(default=0)
+    done = models.PositiveIntegerField(default=0)
+    last_photo_id = models.PositiveBigIntegerField(default=0)
+    started_at = models.DateTimeField(default=timezone.now)
+    updated_at = models.DateTimeField(default=timezone.now)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    @property
+    def finished(self) -> bool:
+        return self.finished_at is not None
+
+    @property
+    def eta(self) -> timedelta | None:
+        if self.finished or not self.done:
+            return None
+        elapsed = self.updated_at - self.started_at
+        remaining = max(self.total - self.done, 0)
+        return elapsed / self.done * remaining
+
+    def __str__(self):
+        return f"Regeneration of {self.size.slug}: {self.done}/{self.total}"
+
+
 class PhotoSize(models.Model):
     def get_image_file_path(instance, filename):
         ext = os.path.splitext(filename)[1]
         random_str = uuid.uuid4().hex[:16]
         kebab_title = slugify(instance.photo.title)
         new_filename = f"{random_str}-{kebab_title}_{instance.size.slug}{ext}"
-        return os.path.join(CONTENT_RESIZED_PHOTOS_PATH, new_filename)
+        return sharded_path(CONTENT_RESIZED_PHOTOS_PATH, new_filename)
 
     photo = models.ForeignKey("core.Photo", on_delete=models.CASCADE, related_name="sizes")
     size = models.ForeignKey(Size, on_delete=models.CASCADE, related_name="photos")
@@ -394,10 +562,43 @@ class PhotoSize(models.Model):
     height = models.PositiveIntegerField(null=True)
     width = models.PositiveIntegerField(null=True)
     md5 = models.CharField(max_length=32, null=True)
+    format = models.CharField(max_length=8, choices=Size.OutputFormat.choices, default=Size.OutputFormat.JPEG)
+    # What this render was made from: the raw file's md5 and the size's render fingerprint
+    source_md5 = models.CharField(max_length=32, null=True, blank=True)
+    size_fingerprint = models.CharField(max_length=64, blank=True, default="")
 
     class Meta:
         unique_together = ("photo", "size")
         ordering = ["size__max_dimension"]
 
+    @property
+    def content_type(self) -> str:
+        return Size.OUTPUT_FORMAT_TYPES[self.format][1]
+
+    @property
+    def is_stale(self) -> bool:
+        if self.size_fingerprint != self.size.fingerprint:
+            return True
+        # Renders made before source hashes were recorded are trusted
+        return bool(self.source_md5 and self.photo.raw_md5 and self.source_md5 != self.photo.raw_md5)
+
+    @staticmethod
+    def spec_stale_filter() -> models.Q:
+        """Photo sizes rendered with an outdated render spec of their size."""
+        return ~models.Q(size_fingerprint=models.F("size__fingerprint"))
+
+    @staticmethod
+    def source_stale_filter() -> models.Q:
+        """Photo sizes rendered from a raw file that has since been replaced."""
+        return (
+            models.Q(source_md5__isnull=False, photo__raw_md5__isnull=False)
+            & ~models.Q(source_md5=models.F("photo__raw_md5"))
+        )
+
+    @staticmethod
+    def stale_filter() -> models.Q:
+        """Query equivalent of is_stale."""
+        return PhotoSize.spec_stale_filter() | PhotoSize.source_stale_filter()
+
     def __str__(self):
         return f"{self.photo.title} - {self.size.slug}"
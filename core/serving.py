@@ -0,0 +1,188 @@
+import os
+import re
+import secrets
+from urllib.parse import quote
+from django.conf import settings
+from django.http import FileResponse, Http404, HttpResponse, StreamingHttpResponse
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, parse_http_date_safe, quote_etag
+
+
+# Cache-Control for URLs that always serve the same bytes (they include the content hash)
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+
+RANGE_PATTERN = re.compile(r"^\s*(\d*)\s*-\s*(\d*)\s*$")
+# More ranges than this are answered with the whole file
+MAX_RANGES = 16
+RANGE_CHUNK_SIZE = 64 * 1024
+
+
+def render_in_progress_response(retry_after):
+    """503 for a size that another request is still rendering."""
+    response = HttpResponse("Image is being rendered, try again shortly.", status=503, content_type="text/plain")
+    response["Retry-After"] = str(retry_after)
+    response["Cache-Control"] = "no-store"
+    return response
+
+
+def serve_photo_size(request, photo_size, immutable=False, private=False):
+    """
+    Respond with a PhotoSize's image, or 304 when the client's copy is current.
+    With IMAGE_X_ACCEL_REDIRECT, nginx sends the file and no Python worker is
+    held for the transfer.
+
+    immutable marks the response cacheable forever, for content-hashed URLs.
+    Otherwise caches must revalidate, which the ETag makes cheap.
+
+    Range requests get 206 responses that read only the requested bytes.
+    """
+    image_file = photo_size.image
+    if not image_file:
+        raise Http404("Image not available.")
+
+    try:
+        stat = os.stat(image_file.path)
+    except FileNotFoundError:
+        raise Http404("Image not available.")
+    last_modified = int(stat.st_mtime)
+    etag = quote_etag(photo_size.md5) if photo_size.md5 else None
+
+    response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+    if response is None and not settings.IMAGE_X_ACCEL_REDIRECT:
+        # nginx handles ranges itself for X-Accel-Redirect responses
+        ranges = _requested_ranges(request, stat.st_size, etag, last_modified)
+        if ranges is not None:
+            response = _range_response(photo_size, ranges, stat.st_size)
+    if response is None:
+        response = _image_response(photo_size)
+        response["Accept-Ranges"] = "bytes"
+
+    if etag:
+        response["ETag"] = etag
+    response["Last-Modified"] = http_date(last_modified)
+    if immutable:
+        response["Cache-Control"] = IMMUTABLE_CACHE_CONTROL
+    else:
+        response["Cache-Control"] = "private, no-cache" if private else "no-cache"
+    return response
+
+
+def _image_response(photo_size):
+    image_file = photo_size.image
+    if settings.IMAGE_X_ACCEL_REDIRECT:
+        response = HttpResponse(content_type=photo_size.content_type)
+        response["X-Accel-Redirect"] = settings.IMAGE_X_ACCEL_LOCATION + quote(image_file.name)
+        return response
+
+    try:
+        return FileResponse(image_file.open("rb"), content_type=photo_size.content_type)
+    except FileNotFoundError:
+        raise Http404("Image not available.")
+
+
+def _requested_ranges(request, file_size, etag, last_modified):
+    """
+    Return the byte ranges (inclusive, sorted, merged) a request asks for, an
+    empty list when none can be satisfied, or None to send the whole file.
+    """
+    header = request.headers.get("Range")
+    if request.method not in ("GET", "HEAD") or not header:
+        return None
+
+    # If-Range: only send part of the file if the client's copy is still current
+    if_range = request.headers.get("If-Range")
+    if if_range:
+        if if_range.startswith('"') or if_range.startswith("W/"):
+            if if_range != etag:
+                return None
+        elif parse_http_date_safe(if_range) != last_modified:
+            return None
+
+    unit, _, specs = header.partition("=")
+    if unit.strip().lower() != "bytes":
+        return None
+
+    ranges = []
+    for spec in specs.split(","):
+        match = RANGE_PATTERN.match(spec)
+        if not match or match.group(1) == match.group(2) == "":
+            return None  # malformed: ignore the header
+        first, last = match.groups()
+        if first == "":
+            # Suffix range: the last n bytes
+            if int(last) == 0:
+                continue
+            start, end = max(file_size - int(last), 0), file_size - 1
+        else:
+            start = int(first)
+            end = min(int(last), file_size - 1) if last else file_size - 1
+            if last and int(last) < start:
+                return None
+        if start < file_size:
+            ranges.append((start, end))
+
+    if len(ranges) > MAX_RANGES:
+        return None
+
+    merged = []
+    for start, end in sorted(ranges):
+        if merged and start <= merged[-1][1] + 1:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+    return merged
+
+
+def _read_ranges(path, ranges, parts=None):
+    """Yield the bytes of each range, seeking past everything else."""
+    with open(path, "rb") as f:
+        for i, (start, end) in enumerate(ranges):
+            if parts:
+                yield parts[i]
+            f.seek(start)
+            remaining = end - start + 1
+            while remaining > 0:
+                chunk = f.read(min(RANGE_CHUNK_SIZE, remaining))
+                if not chunk:
+                    break
+                remaining -= len(chunk)
+                yield chunk
+            if parts:
+                yield b"\r\n"
+        if parts:
+            yield parts[-1]
+
+
+def _range_response(photo_size, ranges, file_size):
+    if not ranges:
+        response = HttpResponse(status=416)
+        response["Content-Range"] = f"bytes */{file_size}"
+        return response
+
+    path = photo_size.image.path
+    content_type = photo_size.content_type
+
+    if len(ranges) == 1:
+        start, end = ranges[0]
+        response = StreamingHttpResponse(_read_ranges(path, ranges), status=206, content_type=content_type)
+        response["Content-Range"] = f"bytes {start}-{end}/{file_size}"
+        response["Content-Length"] = str(end - start + 1)
+        return response
+
+    boundary = secrets.token_hex(16)
+    parts = [
+        (
+            f"--{boundary}\r\n"
+            f"Content-Type: {content_type}\r\n"
+            f"Content-Range: bytes {start}-{end}/{file_size}\r\n\r\n"
+        ).encode()
+        for start, end in ranges
+    ]
+    parts.append(f"--{boundary}--\r\n".encode())
+    length = sum(len(part) for part in parts) + sum(end - start + 1 + 2 for start, end in ranges)
+
+    response = StreamingHttpResponse(
+        _read_ranges(path, ranges, parts), status=206, content_type=f"multipart/byteranges; boundary={boundary}"
+    )
+    response["Content-Length"] = str(length)
+    return response
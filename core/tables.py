@@ -1,4 +1,6 @@
 import django_tables2 as tables
+from django.utils import timezone
+from django.utils.timesince import timeuntil
 from .models import *
 
 # Include CSS Classes: pagination
@@ -35,6 +37,8 @@ class SizeTable(tables.Table):
     comment = tables.Column()
     max_dimension = tables.Column()
     square_crop = tables.BooleanColumn()
+    output_format = tables.Column(verbose_name="Format")
+    regeneration = tables.Column(empty_values=(), orderable=False)
 
     edit = tables.TemplateColumn(
         template_name="core/partials/size_table_edit_button.html",
@@ -48,9 +52,19 @@ class SizeTable(tables.Table):
         orderable=False
     )
 
+    def render_regeneration(self, record):
+        regeneration = getattr(record, "regeneration", None)
+        if regeneration is None or regeneration.finished:
+            return "—"
+
+        progress = f"{regeneration.done}/{regeneration.total}"
+        if regeneration.eta is not None:
+            progress += f" (ETA {timeuntil(timezone.now() + regeneration.eta)})"
+        return progress
+
     class Meta:
         model = Size
-        fields = ("slug", "comment", "max_dimension", "square_crop", "public")
+        fields = ("slug", "comment", "max_dimension", "square_crop", "output_format", "public", "regeneration")
 
 
 class AlbumTable(tables.Table):
@@ -3,13 +3,28 @@ from . import models
 from PIL import Image
 from io import BytesIO
 from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
 import os
-from PIL.ExifTags import TAGS as ExifTags
-from datetime import datetime
-import exiftool
-from . import CONTENT_RESIZED_PHOTOS_PATH
+import mmap
+import re
+from PIL import UnidentifiedImageError
+from PIL.ExifTags import TAGS as ExifTags, Base as ExifBase, IFD as ExifIFD
+from datetime import datetime, timedelta
+from . import metadata as exiftool_metadata
+from exiftool.exceptions import ExifToolExecuteError
+from . import CONTENT_RESIZED_PHOTOS_PATH, UI_THUMBNAIL_LARGE, UI_THUMBNAIL_SMALL, content_addressed_path
 from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Count, Exists, F, OuterRef, Q
+from django.utils import timezone
 import hashlib
+import logging
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager, nullcontext
+
+logger = logging.getLogger(__name__)
 
 
 # Metadata tag constants
@@ -19,6 +34,8 @@ METADATA_XMP_RATING = "XMP:Rating"
 METADATA_EXIF_MAKE = "EXIF:Make"
 METADATA_EXIF_MODEL = "EXIF:Model"
 METADATA_COMPOSITE_LENS_ID = "Composite:LensID"
+# The lens as the camera recorded it, read by the Pillow backend; ExifTool's LensID is preferred
+METADATA_EXIF_LENS_MODEL = "EXIF:LensModel"
 
 METADATA_EXIF_FOCAL_LENGTH = "EXIF:FocalLength"
 METADATA_EXIF_FOCAL_LENGTH_35MM = "Composite:FocalLength35efl"
@@ -32,42 +49,448 @@ METADATA_EXIF_FLASH = "EXIF:Flash"
 
 METADATA_EXIF_COPYRIGHT = "EXIF:Copyright"
 
+METADATA_TAGS = [
+    f"-{METADATA_EXIF_DATETIME_ORIGINAL}",
+    f"-{METADATA_XMP_RATING}",
+    f"-{METADATA_EXIF_MAKE}",
+    f"-{METADATA_EXIF_MODEL}",
+    f"-{METADATA_COMPOSITE_LENS_ID}",
+    f"-{METADATA_EXIF_FOCAL_LENGTH}#",
+    f"-{METADATA_EXIF_FOCAL_LENGTH_35MM}#",
+    f"-{METADATA_EXIF_APERTURE}#",
+    f"-{METADATA_EXIF_SHUTTER_SPEED}#",
+    f"-{METADATA_EXIF_ISO}#",
+    f"-{METADATA_EXIF_EXPOSURE_PROGRAM}",
+    f"-{METADATA_EXIF_EXPOSURE_COMPENSATION}#",
+    f"-{METADATA_EXIF_FLASH}",
+    f"-{METADATA_EXIF_COPYRIGHT}",
+    # Stop at the end of the metadata instead of scanning the whole file for trailers
+    "-fast",
+]
+METADATA_FIELDS = [
+    "capture_date", "rating", "camera_make", "camera_model", "lens_model",
+    "focal_length", "focal_length_35mm", "aperture", "shutter_speed", "iso",
+    "exposure_program", "exposure_compensation", "flash", "copyright",
+]
+# Photos read per ExifTool call when extracting metadata in bulk
+METADATA_BATCH_SIZE = 200
 
-def gen_size(photo, size):
-    photo.raw_image.open()  # ensure file is ready
-    with Image.open(photo.raw_image) as img:
-        exif_data = img.info.get('exif') # Preserve EXIF data
+# Standard EXIF tags the Pillow backend reads in-process, keyed by the ExifTool tag they stand in for
+PILLOW_EXIF_TAGS = {
+    METADATA_EXIF_DATETIME_ORIGINAL: ExifBase.DateTimeOriginal,
+    METADATA_EXIF_MAKE: ExifBase.Make,
+    METADATA_EXIF_MODEL: ExifBase.Model,
+    METADATA_EXIF_LENS_MODEL: ExifBase.LensModel,
+    METADATA_EXIF_FOCAL_LENGTH: ExifBase.FocalLength,
+    METADATA_EXIF_FOCAL_LENGTH_35MM: ExifBase.FocalLengthIn35mmFilm,
+    METADATA_EXIF_APERTURE: ExifBase.FNumber,
+    METADATA_EXIF_SHUTTER_SPEED: ExifBase.ExposureTime,
+    METADATA_EXIF_ISO: ExifBase.ISOSpeedRatings,
+    METADATA_EXIF_EXPOSURE_PROGRAM: ExifBase.ExposureProgram,
+    METADATA_EXIF_EXPOSURE_COMPENSATION: ExifBase.ExposureBiasValue,
+    METADATA_EXIF_FLASH: ExifBase.Flash,
+    METADATA_EXIF_COPYRIGHT: ExifBase.Copyright,
+}
+PILLOW_NUMERIC_TAGS = {
+    METADATA_EXIF_FOCAL_LENGTH, METADATA_EXIF_FOCAL_LENGTH_35MM, METADATA_EXIF_APERTURE,
+    METADATA_EXIF_SHUTTER_SPEED, METADATA_EXIF_EXPOSURE_COMPENSATION,
+}
+# ExifTool composites Pillow can't compute, keyed by the tags that stand in for them in-process.
+# ExifTool is only asked for one when none of its stand-ins were read.
+EXIFTOOL_FALLBACK_TAGS = {
+    f"-{METADATA_COMPOSITE_LENS_ID}": (METADATA_COMPOSITE_LENS_ID, METADATA_EXIF_LENS_MODEL),
+    f"-{METADATA_EXIF_FOCAL_LENGTH_35MM}#": (METADATA_EXIF_FOCAL_LENGTH_35MM,),
+}
+XMP_RATING_PATTERN = re.compile(rb'xmp:Rating(?:="|>)(\d+)')
+
+# ExifTool's printed values, so both backends store the same strings
+EXIFTOOL_EXPOSURE_PROGRAMS = {
+    0: "Not Defined",
+    1: "Manual",
+    2: "Program AE",
+    3: "Aperture-priority AE",
+    4: "Shutter speed priority AE",
+    5: "Creative (Slow speed)",
+    6: "Action (High speed)",
+    7: "Portrait",
+    8: "Landscape",
+    9: "Bulb",
+}
+EXIFTOOL_FLASH_VALUES = {
+    0x00: "No Flash",
+    0x01: "Fired",
+    0x05: "Fired, Return not detected",
+    0x07: "Fired, Return detected",
+    0x08: "On, Did not fire",
+    0x09: "On, Fired",
+    0x0d: "On, Return not detected",
+    0x0f: "On, Return detected",
+    0x10: "Off, Did not fire",
+    0x14: "Off, Did not fire, Return not detected",
+    0x18: "Auto, Did not fire",
+    0x19: "Auto, Fired",
+    0x1d: "Auto, Fired, Return not detected",
+    0x1f: "Auto, Fired, Return detected",
+    0x20: "No flash function",
+    0x30: "Off, No flash function",
+    0x41: "Fired, Red-eye reduction",
+    0x45: "Fired, Red-eye reduction, Return not detected",
+    0x47: "Fired, Red-eye reduction, Return detected",
+    0x49: "On, Red-eye reduction",
+    0x4d: "On, Red-eye reduction, Return not detected",
+    0x4f: "On, Red-eye reduction, Return detected",
+    0x50: "Off, Red-eye reduction",
+    0x58: "Auto, Did not fire, Red-eye reduction",
+    0x59: "Auto, Fired, Red-eye reduction",
+    0x5d: "Auto, Fired, Red-eye reduction, Return not detected",
+    0x5f: "Auto, Fired, Red-eye reduction, Return detected",
+}
+
+# Decode JPEGs at no less than this multiple of the largest target size
+DRAFT_REDUCING_GAP = 2.0
+
+# Lazy rendering: how long a request may hold a render lock, and wait on another's
+LAZY_RENDER_LOCK_TIMEOUT = 60
+# Requests wait this long for another request's render, then answer 503 with Retry-After
+LAZY_RENDER_WAIT = 3
+LAZY_RENDER_RETRY_AFTER = 5
+# Writing a render's file and row is serialized per (photo, size) across workers and requests
+RENDER_WRITE_LOCK_TIMEOUT = 60
+RENDER_WRITE_LOCK_WAIT = 60
+# Reusing and deleting a deduplicated file is serialized per content hash
+CONTENT_LOCK_TIMEOUT = 60
+CONTENT_LOCK_WAIT = 60
+CONTENT_DIGEST_PATTERN = re.compile(r"[0-9a-f]{32}")
+
+# Consistency checks walk photo sizes and files in chunks, stopping after the time budget
+# and resuming from a checkpoint on the next run
+CONSISTENCY_CHUNK_SIZE = 1000
+CONSISTENCY_TIME_BUDGET = 60 * 20
+CONSISTENCY_CHECKPOINT_KEY = "photoserv:consistency:checkpoint"
+# Photos queued for re-rendering per run
+CONSISTENCY_MAX_RENDERS = 5000
+# Files modified this recently are never treated as strays
+CONSISTENCY_GRACE_PERIOD = 60 * 10
+
+# Files checked for remaining references per query when deleting
+DELETE_FILES_CHUNK_SIZE = 500
+
+# Photos due within this many seconds get a task scheduled for their exact publish time.
+# Kept below the Redis broker's one hour visibility timeout, after which unacknowledged
+# ETA tasks are redelivered; publish_photos schedules the rest as they come due.
+PUBLISH_ETA_HORIZON = 60 * 50
+
+
+def _fit_dimensions(dimensions, max_dimension):
+    """Return dimensions scaled down to fit a max_dimension square."""
+    width, height = dimensions
+    if max(width, height) <= max_dimension:
+        return dimensions
+
+    scale = max_dimension / max(width, height)
+    return (max(1, round(width * scale)), max(1, round(height * scale)))
+
+
+def _resize_to_fit(img, max_dimension):
+    """Return img scaled down to fit a max_dimension square, or img itself if it already fits."""
+    new_size = _fit_dimensions(img.size, max_dimension)
+    if new_size == img.size:
+        return img
+
+    return img.resize(new_size, Image.Resampling.LANCZOS, reducing_gap=2.0)
+
+
+def _draft_decode(img, sizes):
+    """
+    Ask the JPEG decoder for a 1/2, 1/4 or 1/8 scale image that is still at least
+    DRAFT_REDUCING_GAP times the largest target, so the final LANCZOS resample keeps
+    full quality. No-op for other formats or if any size opts out.
+    """
+    if not all(size.draft_decode for size in sizes):
+        return
+
+    target = _fit_dimensions(img.size, max(size.max_dimension for size in sizes))
+    img.draft(None, (int(target[0] * DRAFT_REDUCING_GAP), int(target[1] * DRAFT_REDUCING_GAP)))
+
+
+def _apply_square_crop(img, size):
+    # Square crop, centered
+    width, height = img.size
+    min_dim = min(width, height)
+    left = (width - min_dim) // 2
+    top = (height - min_dim) // 2
+    right = left + min_dim
+    bottom = top + min_dim
+    img = img.crop((left, top, right, bottom))
+    # Resize to exact max_dimension if necessary
+    if min_dim != size.max_dimension:
+        img = img.resize((size.max_dimension, size.max_dimension), Image.Resampling.LANCZOS)
+    return img
+
+
+def _encode_size(img, size, exif_data):
+    """Crop and encode a resized image. Runs on a render thread; must not touch the database."""
+    if size.square_crop:
+        img = _apply_square_crop(img, size)
+
+    options = {'quality': size.quality}
+    if exif_data:
+        options['exif'] = exif_data
+
+    if size.output_format == models.Size.OutputFormat.JPEG:
+        # JPEG has no alpha or palette support
+        if img.mode not in ('RGB', 'L', 'CMYK'):
+            img = img.convert('RGB')
+        options.update(optimize=size.optimize, progressive=size.progressive)
+        if size.subsampling:
+            options['subsampling'] = size.subsampling
+    elif size.output_format == models.Size.OutputFormat.WEBP:
+        options['method'] = 6 if size.optimize else 4
+    elif size.output_format == models.Size.OutputFormat.AVIF:
+        options['speed'] = 4 if size.optimize else 6
+        if size.subsampling:
+            options['subsampling'] = size.subsampling
+
+    buffer = BytesIO()
+    img.save(buffer, format=size.output_format, **options)
+
+    return img.size, buffer.getvalue()
+
+
+class RenderInProgress(Exception):
+    """A lazily rendered size is being rendered by another request."""
 
-        # Use updated resampling constant
-        img.thumbnail((size.max_dimension, size.max_dimension), Image.Resampling.LANCZOS)
-
-        # Square crop, centered
-        if size.square_crop:
-            width, height = img.size
-            min_dim = min(width, height)
-            left = (width - min_dim) // 2
-            top = (height - min_dim) // 2
-            right = left + min_dim
-            bottom = top + min_dim
-            img = img.crop((left, top, right, bottom))
-            # Resize to exact max_dimension if necessary
-            if min_dim != size.max_dimension:
-                img = img.resize((size.max_dimension, size.max_dimension), Image.Resampling.LANCZOS)
-
-        buffer = BytesIO()
-        if exif_data:
-            img.save(buffer, format='JPEG', exif=exif_data)
+
+def _acquire_cache_lock(key, timeout):
+    """Try once to take a lock in the shared cache, returning this holder's token if it did."""
+    token = uuid.uuid4().hex
+    return token if cache.add(key, token, timeout=timeout) else None
+
+
+def _release_cache_lock(key, token):
+    """Release a lock only while it is still ours; once it expires it may belong to another holder."""
+    if cache.get(key) == token:
+        cache.delete(key)
+
+
+@contextmanager
+def _cache_lock(key, timeout, wait):
+    """Hold a lock in the shared cache, waiting up to `wait` seconds to acquire it."""
+    deadline = time.monotonic() + wait
+    token = _acquire_cache_lock(key, timeout)
+    while not token:
+        if time.monotonic() >= deadline:
+            raise TimeoutError(f"Timed out waiting for lock {key}.")
+        time.sleep(0.05)
+        token = _acquire_cache_lock(key, timeout)
+    try:
+        yield
+    finally:
+        _release_cache_lock(key, token)
+
+
+def _render_write_lock(photo, size):
+    return _cache_lock(f"photoserv:render:write:{photo.id}:{size.id}", RENDER_WRITE_LOCK_TIMEOUT, RENDER_WRITE_LOCK_WAIT)
+
+
+def content_lock(digest):
+    """Lock deduplicated content, so it can't be deleted between reusing it and saving the row."""
+    return _cache_lock(f"photoserv:content:{digest}", CONTENT_LOCK_TIMEOUT, CONTENT_LOCK_WAIT)
+
+
+def _content_digest(name):
+    """The content hash a deduplicated file is named by, or None for any other file."""
+    stem = os.path.splitext(os.path.basename(name))[0]
+    return stem if CONTENT_DIGEST_PATTERN.fullmatch(stem) else None
+
+
+def _save_photo_size(photo, size, raw_md5, dimensions, data):
+    md5 = hashlib.md5(data).hexdigest()
+    # Serialized with background and lazy renders of the same size
+    with _render_write_lock(photo, size):
+        photo_size, replaced = _prepare_photo_size(
+            photo, size, raw_md5, width=dimensions[0], height=dimensions[1], md5=md5
+        )
+        if settings.CONTENT_DEDUPLICATION:
+            # Identical renders share one file
+            storage = photo_size.image.storage
+            name = content_addressed_path(CONTENT_RESIZED_PHOTOS_PATH, md5, size.extension)
+            with content_lock(md5):
+                if not storage.exists(name):
+                    name = storage.save(name, ContentFile(data))
+                photo_size.image.name = name
+                photo_size.save()
         else:
-            img.save(buffer, format='JPEG')
+            photo_size.image.save(
+                f"{photo.id}_{size.slug}{size.extension}",
+                ContentFile(data),
+                save=True
+            )
+        _release_replaced(photo_size, replaced)
+    return photo_size
+
+
+def _is_passthrough(img, size):
+    """
+    A size can reuse the raw file as-is if it would not resize, crop or change its format,
+    and asks for no particular encoding.
+    """
+    return (
+        img.format == size.output_format and not size.square_crop and size.max_dimension >= max(img.size)
+        and size.default_encoding
+    )
+
+
+@contextmanager
+def open_raw(photo):
+    """
+    Map a photo's raw file into memory, so hashing, decoding and copying it
+    share a single read of the file. An empty file can't be mapped and is reported
+    as an unreadable image.
+    """
+    with open(photo.raw_image.path, 'rb') as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            raise UnidentifiedImageError(f"Raw image file for photo id {photo.id} is empty.")
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as raw:
+            yield raw
+
+
+def _file_md5(path):
+    md5 = hashlib.md5()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            md5.update(chunk)
+    return md5.hexdigest()
+
+
+def _prepare_photo_size(photo, size, source_md5, **fields):
+    """
+    Return the PhotoSize row to write a render into (the existing row when re-rendering a
+    stale size) with its render spec recorded, and the name of the file it replaces.
+    """
+    photo_size = models.PhotoSize.objects.filter(photo=photo, size=size).first() or models.PhotoSize(photo=photo, size=size)
+    replaced = photo_size.image.name or None
+
+    for field, value in fields.items():
+        setattr(photo_size, field, value)
+    photo_size.format = size.output_format
+    photo_size.size_fingerprint = size.fingerprint
+    photo_size.source_md5 = source_md5
+    return photo_size, replaced
+
+
+def _release_replaced(photo_size, replaced):
+    if replaced and replaced != photo_size.image.name:
+        delete_files.delay_on_commit([photo_size.image.storage.path(replaced)])
+
 
-        photo_size = models.PhotoSize(photo=photo, size=size, height=img.height, width=img.width, md5=hashlib.md5(buffer.getvalue()).hexdigest())
-        photo_size.image.save(
-            f"{photo.id}_{size.slug}.jpg",
-            ContentFile(buffer.getvalue()),
-            save=True
+def _link_photo_size(photo, size, dimensions, raw_md5, raw):
+    """Create a PhotoSize that shares the raw file's bytes instead of re-encoding them."""
+    raw_path = photo.raw_image.path
+    # Serialized with background and lazy renders of the same size
+    with _render_write_lock(photo, size):
+        photo_size, replaced = _prepare_photo_size(
+            photo, size, raw_md5, width=dimensions[0], height=dimensions[1], md5=raw_md5
         )
+        storage = photo_size.image.storage
+        ext = os.path.splitext(raw_path)[1]
+        if settings.CONTENT_DEDUPLICATION:
+            name = content_addressed_path(CONTENT_RESIZED_PHOTOS_PATH, raw_md5, ext)
+        else:
+            name = storage.get_available_name(photo_size.image.field.generate_filename(photo_size, f"{photo.id}_{size.slug}{ext}"))
+        dest_path = storage.path(name)
+
+        with content_lock(raw_md5) if settings.CONTENT_DEDUPLICATION else nullcontext():
+            # Deduplicated content may already be stored
+            if not (settings.CONTENT_DEDUPLICATION and os.path.isfile(dest_path) and os.path.getsize(dest_path) == len(raw)):
+                _write_file_atomic(dest_path, raw_path, raw)
+
+            photo_size.image.name = name
+            photo_size.save()
+        _release_replaced(photo_size, replaced)
+    return photo_size
+
+
+def _write_file_atomic(dest_path, raw_path, raw):
+    """
+    Hardlink the raw file to dest_path when they share a filesystem, otherwise copy its
+    bytes. Either is done under a temporary name and moved into place, so dest_path
+    never holds a partly written file.
+    """
+    os.makedirs(os.path.dirname(dest_path), exist_ok=True)
+    tmp_path = f"{dest_path}.{uuid.uuid4().hex}.tmp"
+    try:
+        try:
+            os.link(raw_path, tmp_path)
+        except OSError:
+            with open(tmp_path, 'wb') as f:
+                f.write(raw)
+        os.replace(tmp_path, dest_path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def _update_raw_md5(photo, raw=None):
+    """Hash the raw file and record it on the photo if it changed."""
+    raw_md5 = hashlib.md5(raw).hexdigest() if raw is not None else _file_md5(photo.raw_image.path)
+    if raw_md5 != photo.raw_md5:
+        photo.raw_md5 = raw_md5
+        models.Photo.objects.filter(pk=photo.pk).update(raw_md5=raw_md5)
+    return raw_md5
+
+
+def render_sizes(photo, sizes, raw=None):
+    """
+    Render sizes for a photo from a single decode of its raw image. Existing
+    renders of these sizes are replaced in place.
+
+    Sizes are rendered largest first, and each one is derived from the previous
+    (uncropped) render, so small thumbnails never touch the full resolution image.
+    When only small sizes are missing, JPEGs are decoded at a reduced scale, and
+    sizes at least as large as the raw JPEG reuse its bytes without decoding at all.
+
+    raw is the mapped raw file from open_raw; it is opened here when not given.
+    """
+    sizes = sorted(sizes, key=lambda s: s.max_dimension, reverse=True)
+    if not sizes:
+        return []
+
+    if raw is None:
+        with open_raw(photo) as raw:
+            return render_sizes(photo, sizes, raw)
 
-        return f"Sizes generated for photo id {photo.id}."
+    raw_md5 = _update_raw_md5(photo, raw)
+    photo_sizes = []
+    raw.seek(0)
+    with Image.open(raw) as img:
+        passthrough = [size for size in sizes if _is_passthrough(img, size)]
+        for size in passthrough:
+            photo_sizes.append(_link_photo_size(photo, size, img.size, raw_md5, raw))
+
+        sizes = [size for size in sizes if size not in passthrough]
+        if not sizes:
+            return photo_sizes
+
+        exif_data = img.info.get('exif') # Preserve EXIF data
+        _draft_decode(img, sizes)
+        img.load()
+
+        # Each downscale feeds the next one, while cropping and encoding of
+        # finished sizes overlaps on the pool. Pillow releases the GIL for both.
+        with ThreadPoolExecutor(max_workers=settings.PHOTO_SIZE_RENDER_THREADS) as pool:
+            encoded = []
+            source = img
+            for size in sizes:
+                source = _resize_to_fit(source, size.max_dimension)
+                encoded.append((size, pool.submit(_encode_size, source, size, exif_data)))
+
+            # Write rows on this thread once every size has been rendered
+            for size, future in encoded:
+                photo_sizes.append(_save_photo_size(photo, size, raw_md5, *future.result()))
+
+    return photo_sizes
 
 
 # Function parse_exif_date. Returns datetime object or None
@@ -78,26 +501,91 @@ def parse_exif_date(date_str) -> datetime | None:
         return None
 
 
+def get_or_render_size(photo, slug, public_only=False):
+    """
+    Return a photo's PhotoSize for a size slug. With lazy rendering enabled, a missing
+    or stale render is rendered synchronously, one request per (photo, size) at a time;
+    other requests for it wait briefly, then get RenderInProgress.
+    """
+    photo_sizes = photo.sizes.select_related("size").filter(size__slug=slug)
+    if public_only:
+        photo_sizes = photo_sizes.filter(size__public=True)
+    photo_size = photo_sizes.first()
+
+    if not settings.PHOTO_SIZE_LAZY_RENDERING or (photo_size and not photo_size.is_stale):
+        return photo_size
+
+    if photo_size:
+        size = photo_size.size
+    else:
+        sizes = models.Size.objects.filter(slug=slug)
+        size = (sizes.filter(public=True) if public_only else sizes).first()
+        if size is None:
+            return None
+
+    lock = f"photoserv:render:{photo.id}:{size.id}"
+    token = _acquire_cache_lock(lock, LAZY_RENDER_LOCK_TIMEOUT)
+    if token:
+        try:
+            render_sizes(photo, [size])
+        except (FileNotFoundError, UnidentifiedImageError):
+            return photo_size
+        finally:
+            _release_cache_lock(lock, token)
+    else:
+        # Another request is rendering this size; wait briefly for it to finish
+        deadline = time.monotonic() + LAZY_RENDER_WAIT
+        while cache.get(lock):
+            if time.monotonic() >= deadline:
+                raise RenderInProgress()
+            time.sleep(0.1)
+
+    return photo_sizes.first()
+
+
+def _render_outdated_sizes(photo, sizes, raw=None):
+    """Render the sizes a photo is missing or has stale renders of."""
+    existing = {ps.size_id: ps for ps in photo.sizes.select_related("size")}
+
+    # The raw is unhashed when it is new or was replaced; hash it before deciding what is stale
+    if photo.raw_md5 is None and any(ps.source_md5 for ps in existing.values()):
+        _update_raw_md5(photo, raw)
+
+    # Skip sizes that already have an up-to-date render
+    sizes = [size for size in sizes if size.id not in existing or existing[size.id].is_stale]
+    return render_sizes(photo, sizes, raw)
+
+
 @shared_task
-def generate_sizes_for_photo(photo_id):
+def generate_sizes_for_photo(photo_id, size_ids=None):
     try:
         photo = models.Photo.objects.get(id=photo_id)
     except models.Photo.DoesNotExist:
         return f"Photo with id {photo_id} does not exist."
 
     sizes = models.Size.objects.all()
-    for size in sizes:
-        if models.PhotoSize.objects.filter(photo=photo, size=size).exists():
-            continue  # Skip if already exists
+    if size_ids is not None:
+        sizes = sizes.filter(id__in=size_ids)
 
-        try:
-            gen_size(photo, size)
-        except FileNotFoundError:
-            return f"Raw image file for photo id {photo.id} not found."
+    try:
+        _render_outdated_sizes(photo, sizes)
+    except FileNotFoundError:
+        return f"Raw image file for photo id {photo.id} not found."
+    except UnidentifiedImageError:
+        return f"Raw image file for photo id {photo.id} is not a readable image."
     
     return f"Sizes generated for photo id {photo.id}."
 
 
+@shared_task
+def generate_sizes_for_photos(photo_ids):
+    """Render missing or stale sizes for a batch of photos."""
+    for photo_id in photo_ids:
+        generate_sizes_for_photo(photo_id)
+
+    return f"Sizes generated for {len(photo_ids)} photos."
+
+
 @shared_task
 def generate_photo_sizes_for_size(size_id):
     try:
@@ -105,22 +593,112 @@ def generate_photo_sizes_for_size(size_id):
     except models.Size.DoesNotExist:
         return f"Size with id {size_id} does not exist."
 
-    photos = models.Photo.objects.all()
-    for photo in photos:
-        generate_sizes_for_photo.delay(photo.id)
+    # (Re)start from the first photo. A new run id stops any chunk chain still running for this size.
+    now = timezone.now()
+    regeneration, _ = models.SizeRegeneration.objects.update_or_create(size=size, defaults={
+        "run_id": uuid.uuid4(),
+        "fingerprint": size.fingerprint,
+        "total": models.Photo.objects.count(),
+        "done": 0,
+        "last_photo_id": 0,
+        "started_at": now,
+        "updated_at": now,
+        "finished_at": None,
+    })
+    regenerate_size_chunk.delay(size.id, str(regeneration.run_id))
     
-    return f"Size generation tasks queued for size id {size.id}."
+    return f"Size regeneration started for size id {size.id}."
+
+
+@shared_task
+def regenerate_size_chunk(size_id, run_id):
+    """
+    Render one chunk of photos for a size regeneration, then queue the next chunk.
+    Only one chunk per size is in flight at a time, and progress is saved after every
+    photo so an interrupted regeneration can be resumed where it stopped.
+    """
+    try:
+        regeneration = models.SizeRegeneration.objects.get(size_id=size_id, run_id=run_id)
+    except models.SizeRegeneration.DoesNotExist:
+        return f"Regeneration run {run_id} for size id {size_id} was superseded."
+
+    photo_ids = list(
+        models.Photo.objects.filter(id__gt=regeneration.last_photo_id)
+        .order_by("id")
+        .values_list("id", flat=True)[:settings.SIZE_REGENERATION_CHUNK_SIZE]
+    )
+
+    if not photo_ids:
+        regeneration.finished_at = timezone.now()
+        regeneration.save(update_fields=["finished_at"])
+        return f"Size regeneration finished for size id {size_id}."
+
+    for photo_id in photo_ids:
+        generate_sizes_for_photo(photo_id, size_ids=[size_id])
+        updated = models.SizeRegeneration.objects.filter(size_id=size_id, run_id=run_id).update(
+            done=F("done") + 1, last_photo_id=photo_id, updated_at=timezone.now()
+        )
+        if not updated:
+            return f"Regeneration run {run_id} for size id {size_id} was superseded."
+
+    regenerate_size_chunk.delay(size_id, run_id)
+
+    return f"Rendered {len(photo_ids)} photos for size id {size_id}."
+
+
+@shared_task
+def resume_size_regenerations():
+    """Restart regenerations that have made no progress recently, e.g. after a worker restart."""
+    stalled_before = timezone.now() - timedelta(seconds=settings.SIZE_REGENERATION_STALL_TIMEOUT)
+    stalled = models.SizeRegeneration.objects.filter(finished_at__isnull=True, updated_at__lt=stalled_before)
+
+    resumed = 0
+    for regeneration in stalled:
+        regeneration.run_id = uuid.uuid4()
+        regeneration.updated_at = timezone.now()
+        regeneration.save(update_fields=["run_id", "updated_at"])
+        regenerate_size_chunk.delay(regeneration.size_id, str(regeneration.run_id))
+        resumed += 1
+
+    return f"Resumed {resumed} size regenerations."
 
 
 @shared_task
 def delete_files(files):
-    for path in files:
-        try:
-            os.remove(path)
-        except FileNotFoundError:
-            pass
-    
-    return f"Deleted {len(files)} files."
+    """
+    Delete files, given as paths or storage names, that no photo or photo size references.
+    A file can be shared through deduplicated content, so deleting a row releases its
+    reference and the file goes with the last one. Deduplicated files are checked again
+    and removed under their content lock, so a concurrent upload or render can't reuse
+    one as it is deleted.
+    """
+    deleted = 0
+    for chunk in _chunks(files, DELETE_FILES_CHUNK_SIZE):
+        paths = {os.path.relpath(default_storage.path(name), settings.MEDIA_ROOT): default_storage.path(name) for name in chunk}
+        referenced = set(models.Photo.objects.filter(raw_image__in=paths).values_list("raw_image", flat=True))
+        referenced.update(models.PhotoSize.objects.filter(image__in=paths).values_list("image", flat=True))
+
+        for name, path in paths.items():
+            if name in referenced:
+                continue
+            digest = _content_digest(name)
+            with content_lock(digest) if digest else nullcontext():
+                if digest and _is_referenced(name):
+                    continue
+                try:
+                    os.remove(path)
+                    deleted += 1
+                except FileNotFoundError:
+                    pass
+
+    return f"Deleted {deleted} files."
+
+
+def _is_referenced(name):
+    return (
+        models.Photo.objects.filter(raw_image=name).exists()
+        or models.PhotoSize.objects.filter(image=name).exists()
+    )
 
 
 @shared_task
@@ -129,137 +707,499 @@ def generate_photo_metadata(photo_id):
         photo = models.Photo.objects.get(id=photo_id)
     except models.Photo.DoesNotExist:
         return f"Photo with id {photo_id} does not exist."
-    
-    photo.raw_image.open()  # ensure file is ready
+
+    return _generate_photo_metadata(photo)
+
+
+def _generate_photo_metadata(photo, raw=None):
+    if raw is None:
+        photo.raw_image.open()  # ensure file is ready
     temp_file_path = photo.raw_image.path
 
-    with exiftool.ExifToolHelper(common_args=["-G"]) as et:
-        metadata_list = et.get_metadata(temp_file_path, [
-            f"-{METADATA_EXIF_DATETIME_ORIGINAL}",
-            f"-{METADATA_XMP_RATING}",
-            f"-{METADATA_EXIF_MAKE}",
-            f"-{METADATA_EXIF_MODEL}",
-            f"-{METADATA_COMPOSITE_LENS_ID}",
-            f"-{METADATA_EXIF_FOCAL_LENGTH}#",
-            f"-{METADATA_EXIF_FOCAL_LENGTH_35MM}#",
-            f"-{METADATA_EXIF_APERTURE}#",
-            f"-{METADATA_EXIF_SHUTTER_SPEED}#",
-            f"-{METADATA_EXIF_ISO}#",
-            f"-{METADATA_EXIF_EXPOSURE_PROGRAM}",
-            f"-{METADATA_EXIF_EXPOSURE_COMPENSATION}#",
-            f"-{METADATA_EXIF_FLASH}",
-            f"-{METADATA_EXIF_COPYRIGHT}"
-        ])
-        if not metadata_list:
-            return f"No metadata found for photo id {photo.id}."
-
-        # Roll all dicts into one (later dicts overwrite earlier ones)
-        metadata_dict = {}
-        for d in metadata_list:
-            metadata_dict.update(d)
-
-        metadata, created = models.PhotoMetadata.objects.get_or_create(photo=photo)
-
-        # Extract relevant metadata
-        metadata.capture_date = parse_exif_date(metadata_dict.get(METADATA_EXIF_DATETIME_ORIGINAL))
-        metadata.rating = metadata_dict.get(METADATA_XMP_RATING)
-
-        metadata.camera_make = metadata_dict.get(METADATA_EXIF_MAKE)
-        metadata.camera_model = metadata_dict.get(METADATA_EXIF_MODEL)
-        metadata.lens_model = metadata_dict.get(METADATA_COMPOSITE_LENS_ID)
-
-        metadata.focal_length = metadata_dict.get(METADATA_EXIF_FOCAL_LENGTH)
-        metadata.focal_length_35mm = metadata_dict.get(METADATA_EXIF_FOCAL_LENGTH_35MM)
-        metadata.aperture = metadata_dict.get(METADATA_EXIF_APERTURE)
-        metadata.shutter_speed = metadata_dict.get(METADATA_EXIF_SHUTTER_SPEED)
-        metadata.iso = metadata_dict.get(METADATA_EXIF_ISO)
-
-        metadata.exposure_program = metadata_dict.get(METADATA_EXIF_EXPOSURE_PROGRAM)
-        metadata.exposure_compensation = metadata_dict.get(METADATA_EXIF_EXPOSURE_COMPENSATION)
-        metadata.flash = metadata_dict.get(METADATA_EXIF_FLASH)
-
-        metadata.copyright = metadata_dict.get(METADATA_EXIF_COPYRIGHT)
-
-        metadata.save()
-
-        return f"Metadata generated for photo id {photo.id}."
+    metadata_dict = _read_metadata([temp_file_path], raw).get(temp_file_path)
+    if not metadata_dict:
+        return f"No metadata found for photo id {photo.id}."
+
+    metadata, created = models.PhotoMetadata.objects.get_or_create(photo=photo)
+    for field, value in _metadata_fields(metadata_dict).items():
+        setattr(metadata, field, value)
+    metadata.save()
+
+    return f"Metadata generated for photo id {photo.id}."
+
+
+@shared_task
+def generate_photo_metadata_batch(photo_ids):
+    """Extract metadata for many photos, batching their ExifTool reads into one call."""
+    photos = {}
+    for photo in models.Photo.objects.filter(id__in=photo_ids).select_related("metadata"):
+        path = photo.raw_image.path
+        # A missing file would fail the whole ExifTool call
+        if os.path.isfile(path):
+            photos[path] = photo
+    if not photos:
+        return "No raw images found."
+
+    created, updated = [], []
+    now = timezone.now()
+    results = _read_metadata(list(photos))
+
+    # Unreadable files get empty metadata, so consistency doesn't retry them forever
+    for path, photo in photos.items():
+        if path not in results:
+            logger.warning("No metadata could be read for photo id %s", photo.id)
+            results[path] = {}
+
+    for path, metadata_dict in results.items():
+        photo = photos.get(path)
+        if photo is None:
+            continue
+
+        try:
+            metadata = photo.metadata
+            updated.append(metadata)
+        except models.PhotoMetadata.DoesNotExist:
+            metadata = models.PhotoMetadata(photo=photo)
+            created.append(metadata)
+
+        for field, value in _metadata_fields(metadata_dict).items():
+            setattr(metadata, field, value)
+        # bulk_update skips auto_now
+        metadata.updated_at = now
+
+    models.PhotoMetadata.objects.bulk_create(created, batch_size=METADATA_BATCH_SIZE)
+    models.PhotoMetadata.objects.bulk_update(
+        updated, [*METADATA_FIELDS, "updated_at"], batch_size=METADATA_BATCH_SIZE
+    )
+
+    return f"Metadata generated for {len(created) + len(updated)} photos."
+
+
+def _read_metadata(paths, raw=None):
+    """
+    Read metadata for raw files as ExifTool-style dicts keyed by path. With the
+    Pillow backend, standard EXIF is read in-process and ExifTool only reads the
+    fields Pillow couldn't, or whole files Pillow can't parse. raw is the mapped
+    file when reading a single path.
+    """
+    results = {}
+    exiftool_paths = list(paths)
+    fallback_paths, fallback_tags = [], set()
+
+    if settings.METADATA_BACKEND == "pillow":
+        exiftool_paths = []
+        for path in paths:
+            metadata_dict = _read_pillow_metadata(raw if raw is not None else path)
+            if metadata_dict is None:
+                exiftool_paths.append(path)
+                continue
+
+            results[path] = metadata_dict
+            missing = [
+                param for param, tags in EXIFTOOL_FALLBACK_TAGS.items()
+                if not any(tag in metadata_dict for tag in tags)
+            ]
+            if missing:
+                fallback_paths.append(path)
+                fallback_tags.update(missing)
+
+    if exiftool_paths:
+        for metadata_dict in _exiftool_read(exiftool_paths, METADATA_TAGS):
+            results.setdefault(metadata_dict.get("SourceFile"), {}).update(metadata_dict)
+
+    if fallback_paths:
+        for metadata_dict in _exiftool_read(fallback_paths, [*sorted(fallback_tags), "-fast"]):
+            found = results.get(metadata_dict.get("SourceFile"))
+            if found is not None:
+                for tag, value in metadata_dict.items():
+                    found.setdefault(tag, value)
+
+    return results
+
+
+def _exiftool_read(paths, params):
+    """
+    Read files with ExifTool. ExifTool fails the whole call when one file is unreadable,
+    so a failed batch is read again one file at a time and only unreadable files are skipped.
+    """
+    try:
+        return exiftool_metadata.get_metadata(paths, params)
+    except ExifToolExecuteError:
+        if len(paths) == 1:
+            logger.warning("ExifTool could not read %s", paths[0])
+            return []
+
+    results = []
+    for path in paths:
+        results.extend(_exiftool_read([path], params))
+    return results
+
+
+def _read_pillow_metadata(source):
+    """
+    Read standard EXIF and the XMP rating with Pillow, keyed and formatted like
+    ExifTool's output. Returns None when Pillow can't read the file's metadata.
+    """
+    if isinstance(source, mmap.mmap):
+        source.seek(0)
+    try:
+        with Image.open(source) as img:
+            exif = img.getexif()
+            tags = {**exif, **exif.get_ifd(ExifIFD.Exif)}
+            xmp = img.info.get("xmp")
+    except (UnidentifiedImageError, OSError, SyntaxError, ValueError):
+        return None
+    if not tags:
+        return None
+
+    metadata_dict = {}
+    for key, tag in PILLOW_EXIF_TAGS.items():
+        value = tags.get(tag)
+        if isinstance(value, tuple):
+            value = value[0] if value else None
+        if isinstance(value, bytes):
+            value = value.decode(errors="replace")
+        if isinstance(value, str):
+            value = value.strip("\x00 ")
+        if value is None or value == "":
+            continue
+        # A 35mm focal length of 0 means unknown; leave it to ExifTool's computed value
+        if key == METADATA_EXIF_FOCAL_LENGTH_35MM and value == 0:
+            continue
+
+        # Malformed values are skipped rather than failing the whole file
+        if key in PILLOW_NUMERIC_TAGS:
+            try:
+                value = float(value)
+            except (TypeError, ValueError, ZeroDivisionError):
+                continue
+        elif key in (METADATA_EXIF_EXPOSURE_PROGRAM, METADATA_EXIF_FLASH):
+            if not isinstance(value, int):
+                continue
+            if key == METADATA_EXIF_EXPOSURE_PROGRAM:
+                value = EXIFTOOL_EXPOSURE_PROGRAMS.get(value, f"Unknown ({value})")
+            else:
+                value = EXIFTOOL_FLASH_VALUES.get(value, f"Unknown (0x{value:x})")
+        metadata_dict[key] = value
+
+    rating = XMP_RATING_PATTERN.search(xmp if isinstance(xmp, bytes) else (xmp or "").encode())
+    if rating:
+        metadata_dict[METADATA_XMP_RATING] = int(rating.group(1))
+
+    return metadata_dict
+
+
+def _metadata_fields(metadata_dict):
+    """Map ExifTool output for one file to PhotoMetadata field values."""
+    return {
+        "capture_date": parse_exif_date(metadata_dict.get(METADATA_EXIF_DATETIME_ORIGINAL)),
+        "rating": metadata_dict.get(METADATA_XMP_RATING),
+
+        "camera_make": metadata_dict.get(METADATA_EXIF_MAKE),
+        "camera_model": metadata_dict.get(METADATA_EXIF_MODEL),
+        "lens_model": metadata_dict.get(METADATA_COMPOSITE_LENS_ID) or metadata_dict.get(METADATA_EXIF_LENS_MODEL),
+
+        "focal_length": metadata_dict.get(METADATA_EXIF_FOCAL_LENGTH),
+        "focal_length_35mm": metadata_dict.get(METADATA_EXIF_FOCAL_LENGTH_35MM),
+        "aperture": metadata_dict.get(METADATA_EXIF_APERTURE),
+        "shutter_speed": metadata_dict.get(METADATA_EXIF_SHUTTER_SPEED),
+        "iso": metadata_dict.get(METADATA_EXIF_ISO),
+
+        "exposure_program": metadata_dict.get(METADATA_EXIF_EXPOSURE_PROGRAM),
+        "exposure_compensation": metadata_dict.get(METADATA_EXIF_EXPOSURE_COMPENSATION),
+        "flash": metadata_dict.get(METADATA_EXIF_FLASH),
+
+        "copyright": metadata_dict.get(METADATA_EXIF_COPYRIGHT),
+    }
 
 
 @shared_task
 def post_photo_create(photo_id):
-    # Run these synchronously after photo creation
-    generate_photo_metadata(photo_id)
+    try:
+        photo = models.Photo.objects.get(id=photo_id)
+    except models.Photo.DoesNotExist:
+        return f"Photo with id {photo_id} does not exist."
+
+    # Metadata and UI thumbnails first so the upload shows up right away. Both come
+    # from one read of the raw: Pillow reads metadata from the mapping, and ExifTool
+    # only reads the header, which the mapping then serves from the page cache.
+    # With INGEST_SINGLE_READ the remaining sizes are rendered from the same mapping.
+    ui_sizes = models.Size.objects.filter(slug__in=[UI_THUMBNAIL_LARGE, UI_THUMBNAIL_SMALL])
+    try:
+        with open_raw(photo) as raw:
+            _generate_photo_metadata(photo, raw)
+            _render_outdated_sizes(photo, ui_sizes, raw)
+            if settings.INGEST_SINGLE_READ:
+                _render_outdated_sizes(photo, models.Size.objects.all(), raw)
+    except FileNotFoundError:
+        return f"Raw image file for photo id {photo.id} not found."
+    except UnidentifiedImageError:
+        return f"Raw image file for photo id {photo.id} is not a readable image."
+
+    if settings.INGEST_SINGLE_READ:
+        photo.update_published(dispatch_signals=True, update_model=True)
+        return f"Generated metadata and sizes and calculated publish state for photo {photo_id}."
+
+    # Remaining sizes and publishing run on the sizes queue
+    post_photo_create_sizes.delay(photo_id)
+
+    return f"Generated metadata and UI sizes for photo {photo_id}."
+
+
+@shared_task
+def post_photo_create_sizes(photo_id):
     generate_sizes_for_photo(photo_id)
     photo = models.Photo.objects.get(id=photo_id)
     photo.update_published(dispatch_signals=True, update_model=True)
-    
-    return f"Generated sizes, metadata, and calculated publish state for photo {photo_id}."
+
+    return f"Generated sizes and calculated publish state for photo {photo_id}."
+
+
+def _walk_files(root, relative_to):
+    """
+    Yield (relative path, mtime) for files under root in sorted path order, listing one
+    directory at a time.
+    """
+    with os.scandir(root) as it:
+        # Directories sort as "name/" so the walk order matches comparing whole paths
+        entries = sorted(it, key=lambda entry: entry.name + ("/" if entry.is_dir(follow_symlinks=False) else ""))
+    for entry in entries:
+        if entry.is_dir(follow_symlinks=False):
+            yield from _walk_files(entry.path, relative_to)
+        elif entry.is_file(follow_symlinks=False):
+            yield os.path.relpath(entry.path, relative_to), entry.stat().st_mtime
+
+
+def _chunks(iterable, size):
+    chunk = []
+    for item in iterable:
+        chunk.append(item)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def _walk_ids(queryset, checkpoint, phase, stop, *fields):
+    """
+    Yield chunks of a queryset's rows in id order, resuming after the id checkpointed for
+    this phase. Rows are ids, or (id, *fields) tuples when fields are given. The walk ends
+    early once stop() is true, recording where to resume; a completed walk clears it.
+    """
+    last_id = checkpoint.get(phase, 0)
+    while True:
+        rows = queryset.filter(id__gt=last_id).order_by("id")
+        rows = rows.values_list("id", *fields) if fields else rows.values_list("id", flat=True)
+        chunk = list(rows[:CONSISTENCY_CHUNK_SIZE])
+        if not chunk:
+            checkpoint.pop(phase, None)
+            return
+
+        yield chunk
+        last_id = chunk[-1][0] if fields else chunk[-1]
+        if stop():
+            checkpoint[phase] = last_id
+            return
+
+
+def _queue_renders(photo_ids, budget):
+    """Queue re-rendering for photos in batches, counting them against the run's budget."""
+    for batch in _chunks(photo_ids, settings.SIZE_REGENERATION_CHUNK_SIZE):
+        generate_sizes_for_photos.apply_async((batch,), queue="bulk")
+    budget["renders"] -= len(photo_ids)
+
+
+def _check_stray_files(checkpoint, stop):
+    """Queue deletion of rendered files with no photo size, resuming after the checkpointed path."""
+    issues = 0
+    last_path = checkpoint.get("stray_path", "")
+    resized_photos_dir = os.path.join(settings.MEDIA_ROOT, CONTENT_RESIZED_PHOTOS_PATH)
+    # Files this new may belong to a render whose photo size isn't committed yet
+    cutoff = time.time() - CONSISTENCY_GRACE_PERIOD
+
+    disk_files = (
+        rel_path for rel_path, mtime in _walk_files(resized_photos_dir, settings.MEDIA_ROOT)
+        if rel_path > last_path and mtime < cutoff
+    )
+    for chunk in _chunks(disk_files, CONSISTENCY_CHUNK_SIZE):
+        known = set(models.PhotoSize.objects.filter(image__in=chunk).values_list("image", flat=True))
+        stray = [os.path.join(settings.MEDIA_ROOT, rel_path) for rel_path in chunk if rel_path not in known]
+        if stray:
+            issues += len(stray)
+            delete_files.delay(stray)
+
+        if stop():
+            checkpoint["stray_path"] = chunk[-1]
+            return issues
+
+    checkpoint.pop("stray_path", None)
+    return issues
 
 
 @shared_task
 def consistency():
+    """
+    Find and queue fixes for inconsistencies between photos, their sizes and the files on
+    disk. Every check walks in chunks and stops once the time budget is spent, saving its
+    position so the next run resumes there. Re-rendering is also capped per run.
+    """
     issues = 0
+    deadline = time.monotonic() + CONSISTENCY_TIME_BUDGET
+    budget = {"renders": CONSISTENCY_MAX_RENDERS}
+    checkpoint = cache.get(CONSISTENCY_CHECKPOINT_KEY) or {}
 
-    # Filesystem
-    # --- Build full paths under MEDIA_ROOT ---
-    resized_photos_dir = os.path.join(settings.MEDIA_ROOT, CONTENT_RESIZED_PHOTOS_PATH)
+    def out_of_time():
+        return time.monotonic() >= deadline
+
+    def out_of_renders():
+        return out_of_time() or budget["renders"] <= 0
 
     # Ensure directories exist
-    os.makedirs(resized_photos_dir, exist_ok=True)
+    os.makedirs(os.path.join(settings.MEDIA_ROOT, CONTENT_RESIZED_PHOTOS_PATH), exist_ok=True)
 
     # Photo Sizes
-    # 1. Ensure every photo size's image file exists
-    photo_sizes = models.PhotoSize.objects.all()
-    for photo_size in photo_sizes:
-        if (not photo_size.image
-            or not os.path.isfile(photo_size.image.path)
-            or not photo_size.height
-            or not photo_size.width
-            or not photo_size.md5):
+    # 1. Delete photo sizes with incomplete records, then those whose file is missing
+    deleted, _ = models.PhotoSize.objects.filter(
+        Q(image="") | Q(height__isnull=True) | Q(height=0) | Q(width__isnull=True) | Q(width=0)
+        | Q(md5__isnull=True) | Q(md5="")
+    ).delete()
+    issues += deleted
+
+    for chunk in _walk_ids(models.PhotoSize.objects.all(), checkpoint, "photo_size_files", out_of_time, "image"):
+        missing = [
+            photo_size_id for photo_size_id, image in chunk
+            if not os.path.isfile(os.path.join(settings.MEDIA_ROOT, image))
+        ]
+        if missing:
+            issues += len(missing)
+            models.PhotoSize.objects.filter(id__in=missing).delete()
+
+    # 2. Re-render sizes whose render spec or raw file changed (lazily rendered on request instead).
+    # Sizes already being regenerated across the library are left to their regeneration.
+    regenerating = models.SizeRegeneration.objects.filter(finished_at__isnull=True).values("size_id")
+    regenerated = models.SizeRegeneration.objects.filter(
+        finished_at__isnull=False, fingerprint=F("size__fingerprint")
+    ).values("size_id")
+    photo_sizes = models.PhotoSize.objects.exclude(size_id__in=regenerating)
+    spec_stale = photo_sizes.filter(models.PhotoSize.spec_stale_filter())
+    # Photos with a replaced raw, or left stale by a finished regeneration of the current spec
+    # (e.g. their raw couldn't be read), are re-rendered one by one
+    needs_render = Exists(
+        photo_sizes.filter(
+            models.PhotoSize.source_stale_filter() | Q(models.PhotoSize.spec_stale_filter(), size_id__in=regenerated),
+            photo_id=OuterRef("pk"),
+        )
+    )
+    if not settings.PHOTO_SIZE_LAZY_RENDERING:
+        # A changed size is re-rendered by one throttled regeneration rather than per photo
+        changed_size_ids = (
+            spec_stale.exclude(size_id__in=regenerated).order_by().values_list("size_id", flat=True).distinct()
+        )
+        for size_id in changed_size_ids:
             issues += 1
-            photo_size.delete()
+            generate_photo_sizes_for_size.delay(size_id)
+
+        stale = models.Photo.objects.filter(needs_render)
+        for chunk in _walk_ids(stale, checkpoint, "stale_photos", out_of_renders):
+            issues += len(chunk)
+            _queue_renders(chunk, budget)
 
     # Photo Objects
-    photos = models.Photo.objects.all()
-    for photo in photos:
-        # 1. Ensure every photo has metadata
-        if not hasattr(photo, 'metadata'):
-            issues += 1
-            generate_photo_metadata.delay(photo.id)
+    # 1. Ensure every photo has metadata
+    missing_metadata = models.Photo.objects.filter(metadata__isnull=True)
+    for chunk in _walk_ids(missing_metadata, checkpoint, "missing_metadata", out_of_time):
+        issues += len(chunk)
+        for batch in _chunks(chunk, METADATA_BATCH_SIZE):
+            generate_photo_metadata_batch.delay(batch)
 
-        # 3. Ensure every photo has sizes
-        sizes = models.Size.objects.all()
-        photo_sizes = models.PhotoSize.objects.filter(photo=photo)
-        if photo_sizes.count() < sizes.count():
-            issues += 1
-            generate_sizes_for_photo.delay(photo.id)
+    # 2. Ensure every photo has sizes; stale photos are re-rendered above
+    if not settings.PHOTO_SIZE_LAZY_RENDERING:
+        incomplete = (
+            models.Photo.objects.annotate(size_count=Count("sizes__size", distinct=True))
+            .filter(size_count__lt=models.Size.objects.count())
+            .exclude(needs_render)
+        )
+        for chunk in _walk_ids(incomplete, checkpoint, "incomplete_photos", out_of_renders):
+            issues += len(chunk)
+            _queue_renders(chunk, budget)
 
     # Filesystem
     # 1. Delete stray resized photos
-    resized_photos = models.PhotoSize.objects.values_list('image', flat=True)
-    delete_files_list = []
-    for disk_file in os.listdir(resized_photos_dir):
-        rel_path = os.path.join(CONTENT_RESIZED_PHOTOS_PATH, disk_file)
-        abs_path = os.path.join(resized_photos_dir, disk_file)
-        if rel_path not in resized_photos:
-            issues += 1
-            delete_files_list.append(abs_path)
+    issues += _check_stray_files(checkpoint, out_of_time)
+
+    cache.set(CONSISTENCY_CHECKPOINT_KEY, checkpoint, timeout=None)
 
-    if len(delete_files_list) > 0:
-        delete_files.delay(delete_files_list)
+    result = f"Identified and queued fixes for {issues} issues." if issues > 0 else "No issues found."
+    if checkpoint:
+        result += " Time or render budget reached, resuming next run."
+    return result
 
-    return f"Identified and queued fixes for {issues} issues." if issues > 0 else "No issues found."
+
+def schedule_publish(photo) -> bool:
+    """
+    Schedule publish_photo for the photo's publish date if it is due within the horizon.
+    Each publish date is scheduled at most once; a changed date schedules anew and the
+    stale task is ignored when it runs.
+    """
+    now = timezone.now()
+    horizon = now + timedelta(seconds=PUBLISH_ETA_HORIZON)
+    if photo.hidden or not photo.publish_date or not now < photo.publish_date <= horizon:
+        return False
+
+    expected = photo.publish_date.isoformat()
+    if not cache.add(f"photoserv:publish:{photo.id}:{expected}", True, timeout=PUBLISH_ETA_HORIZON):
+        return False
+
+    publish_photo.apply_async_on_commit((photo.id, expected), eta=photo.publish_date)
+    return True
+
+
+@shared_task
+def publish_photo(photo_id, expected_publish_date):
+    photo = models.Photo.objects.filter(pk=photo_id).first()
+    if photo is None or photo.publish_date != datetime.fromisoformat(expected_publish_date):
+        return "Publish date changed, skipped."
+
+    # A worker clock slightly behind the scheduler's; try again on time
+    if photo.publish_date > timezone.now():
+        publish_photo.apply_async((photo.id, expected_publish_date), eta=photo.publish_date)
+        return "Not yet due, rescheduled."
+
+    # Missing sizes are rendered on request with lazy rendering; otherwise
+    # publish_photos picks the photo up once its sizes are complete
+    if not settings.PHOTO_SIZE_LAZY_RENDERING and not photo.health.all_sizes:
+        return "Sizes incomplete, deferred."
+
+    if photo.update_published(dispatch_signals=True, update_model=True):
+        return f"Photo {photo.id} published/unpublished."
+    return f"Photo {photo.id} unchanged."
 
 
 @shared_task
 def publish_photos():
-    # Iterate through all photos and call calculate_and_set_published
-    photos = models.Photo.objects.all()
+    # Schedule exact-time publishing for photos coming due before the next runs
+    now = timezone.now()
+    upcoming = models.Photo.objects.filter(
+        hidden=False,
+        _published=False,
+        publish_date__gt=now,
+        publish_date__lte=now + timedelta(seconds=PUBLISH_ETA_HORIZON),
+    )
+    scheduled_count = sum(schedule_publish(photo) for photo in upcoming.iterator())
+
+    # Safety net: only photos whose published state is out of date need a transition
+    photos = models.Photo.objects.filter(models.Photo.publish_transition_filter(now))
+
+    # Missing sizes are rendered on request with lazy rendering
+    if not settings.PHOTO_SIZE_LAZY_RENDERING:
+        photos = photos.annotate(
+            size_count=Count("sizes__size", distinct=True)
+        ).filter(size_count__gte=models.Size.objects.count())
+
     changed_count = 0
-    for photo in photos:
-        if not photo.health.all_sizes:
-            continue
+    for photo in photos.order_by("id").iterator():
         if photo.update_published(dispatch_signals=True, update_model=True):
             changed_count += 1
 
-    return f"{changed_count} photos published/unpublished."
+    return f"{changed_count} photos published/unpublished, {scheduled_count} scheduled."
@@ -1,14 +1,52 @@
 from unittest import mock, skipIf
-from django.test import TestCase
+from django.test import TestCase, override_settings
 from django.core.exceptions import ValidationError
 from .models import *
 from .views import TagUpdateView
+from .forms import SizeForm
 from django.core.exceptions import ObjectDoesNotExist
 from django.urls import reverse
+from django.core.cache import cache
 from django.db.migrations.executor import MigrationExecutor
 from django.db import connection
 from django.apps import apps
 from django.conf import settings
+from django.core.management import call_command
+from django.core.files.uploadedfile import SimpleUploadedFile
+from PIL import Image, UnidentifiedImageError
+from . import metadata, tasks, sharded_path, content_addressed_path, UI_THUMBNAIL_LARGE, UI_THUMBNAIL_SMALL
+from exiftool.exceptions import ExifToolException, ExifToolExecuteError
+import io
+import tempfile
+import shutil
+import hashlib
+import os
+import time
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+
+# For tests that set or clear cache keys, so they never touch the shared Redis database
+# the Celery broker also uses
+LOCMEM_CACHES = {"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}}
+
+
+def create_test_image_file(filename="test.jpg", size=(1200, 800)):
+    """Create a simple in-memory JPEG file"""
+    file = io.BytesIO()
+    Image.new("RGB", size, color="red").save(file, "JPEG")
+    return SimpleUploadedFile(filename, file.getvalue(), content_type="image/jpeg")
+
+
+class TempMediaTestCase(TestCase):
+    """Points MEDIA_ROOT at a fresh temporary directory for each test."""
+
+    def setUp(self):
+        super().setUp()
+        self.media_root = tempfile.mkdtemp()
+        override = override_settings(MEDIA_ROOT=self.media_root)
+        override.enable()
+        self.addCleanup(shutil.rmtree, self.media_root, ignore_errors=True)
+        self.addCleanup(override.disable)
 
 
 class PhotoModelTests(TestCase):
@@ -408,9 +446,121 @@ class SizeTests(TestCase):
 
     @mock.patch("core.tasks.generate_photo_sizes_for_size.delay_on_commit")
     def test_save_triggers_task(self, mock_generate):
+        self.size.max_dimension = 900
         self.size.save()
         self.assertTrue(mock_generate.called)
 
+    @mock.patch("core.tasks.generate_photo_sizes_for_size.delay_on_commit")
+    def test_create_triggers_task(self, mock_generate):
+        size = Size.objects.create(slug="new", max_dimension=300)
+        mock_generate.assert_called_once_with(size.id)
+
+    @mock.patch("core.tasks.delete_files.delay_on_commit")
+    @mock.patch("core.tasks.generate_photo_sizes_for_size.delay_on_commit")
+    def test_non_render_change_keeps_photo_sizes(self, mock_generate, mock_delete):
+        photo = Photo.objects.create(title="Photo", raw_image="r.jpg")
+        PhotoSize.objects.create(photo=photo, size=self.size, image="resized.jpg")
+
+        self.size.comment = "Changed"
+        self.size.public = False
+        self.size.save()
+
+        mock_generate.assert_not_called()
+        mock_delete.assert_not_called()
+        self.assertTrue(PhotoSize.objects.filter(size=self.size).exists())
+
+    @mock.patch("core.tasks.delete_files.delay_on_commit")
+    @mock.patch("core.tasks.generate_photo_sizes_for_size.delay_on_commit")
+    def test_render_change_marks_photo_sizes_stale(self, mock_generate, mock_delete):
+        photo = Photo.objects.create(title="Photo", raw_image="r.jpg")
+        PhotoSize.objects.create(photo=photo, size=self.size, image="resized.jpg", size_fingerprint=self.size.fingerprint)
+
+        size = Size.objects.get(pk=self.size.pk)
+        size.quality = 90
+        size.save()
+
+        mock_generate.assert_called_once_with(size.id)
+        mock_delete.assert_not_called()
+        photo_size = PhotoSize.objects.get(size=size)
+        self.assertTrue(photo_size.is_stale)
+        self.assertTrue(PhotoSize.objects.filter(PhotoSize.stale_filter(), pk=photo_size.pk).exists())
+
+
+@override_settings(SIZE_REGENERATION_CHUNK_SIZE=2)
+@mock.patch("core.tasks.regenerate_size_chunk.delay")
+@mock.patch("core.tasks.generate_sizes_for_photo")
+class SizeRegenerationTests(TestCase):
+    def setUp(self):
+        self.size = Size.objects.create(slug="medium", max_dimension=800)
+        self.photos = [Photo.objects.create(title=f"P{i}", raw_image=f"{i}.jpg") for i in range(3)]
+
+    def test_start_records_progress_and_queues_first_chunk(self, mock_generate, mock_chunk):
+        tasks.generate_photo_sizes_for_size(self.size.id)
+
+        regeneration = self.size.regeneration
+        self.assertEqual((regeneration.done, regeneration.total), (0, 3))
+        self.assertEqual(regeneration.fingerprint, self.size.fingerprint)
+        mock_chunk.assert_called_once_with(self.size.id, str(regeneration.run_id))
+        mock_generate.assert_not_called()
+
+    def test_chunks_walk_photos_by_id(self, mock_generate, mock_chunk):
+        tasks.generate_photo_sizes_for_size(self.size.id)
+        run_id = str(SizeRegeneration.objects.get(size=self.size).run_id)
+
+        tasks.regenerate_size_chunk(self.size.id, run_id)
+        regeneration = SizeRegeneration.objects.get(size=self.size)
+        self.assertEqual(regeneration.done, 2)
+        self.assertEqual(regeneration.last_photo_id, self.photos[1].id)
+        self.assertIsNotNone(regeneration.eta)
+        mock_generate.assert_has_calls([
+            mock.call(self.photos[0].id, size_ids=[self.size.id]),
+            mock.call(self.photos[1].id, size_ids=[self.size.id]),
+        ])
+
+        tasks.regenerate_size_chunk(self.size.id, run_id)
+        tasks.regenerate_size_chunk(self.size.id, run_id)
+        regeneration.refresh_from_db()
+        self.assertEqual(regeneration.done, 3)
+        self.assertTrue(regeneration.finished)
+        self.assertEqual(mock_generate.call_count, 3)
+
+    def test_superseded_run_stops(self, mock_generate, mock_chunk):
+        tasks.generate_photo_sizes_for_size(self.size.id)
+        old_run_id = str(SizeRegeneration.objects.get(size=self.size).run_id)
+        tasks.generate_photo_sizes_for_size(self.size.id)
+
+        tasks.regenerate_size_chunk(self.size.id, old_run_id)
+        mock_generate.assert_not_called()
+
+    def test_resume_restarts_stalled_regeneration(self, mock_generate, mock_chunk):
+        tasks.generate_photo_sizes_for_size(self.size.id)
+        regeneration = SizeRegeneration.objects.get(size=self.size)
+        SizeRegeneration.objects.filter(pk=regeneration.pk).update(
+            last_photo_id=self.photos[0].id, done=1, updated_at=timezone.now() - timedelta(hours=1)
+        )
+        mock_chunk.reset_mock()
+
+        tasks.resume_size_regenerations()
+
+        resumed = SizeRegeneration.objects.get(size=self.size)
+        self.assertNotEqual(resumed.run_id, regeneration.run_id)
+        self.assertEqual(resumed.last_photo_id, self.photos[0].id)
+        mock_chunk.assert_called_once_with(self.size.id, str(resumed.run_id))
+
+    def test_resume_ignores_active_regeneration(self, mock_generate, mock_chunk):
+        tasks.generate_photo_sizes_for_size(self.size.id)
+        mock_chunk.reset_mock()
+
+        tasks.resume_size_regenerations()
+        mock_chunk.assert_not_called()
+
+    def test_size_list_shows_progress(self, mock_generate, mock_chunk):
+        SizeRegeneration.objects.create(size=self.size, total=3, done=1)
+
+        response = self.client.get(reverse("size-list"))
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, "1/3")
+
 
 class PhotoSizeTests(TestCase):
     def test_str_representation(self):
@@ -427,6 +577,730 @@ class PhotoSizeTests(TestCase):
             PhotoSize.objects.create(photo=photo, size=size, image="resized2.jpg")
 
 
+class SizeRenderingTests(TempMediaTestCase):
+    def setUp(self):
+        super().setUp()
+        self.photo = Photo.objects.create(title="Render Me", raw_image=create_test_image_file())
+
+    def test_generate_sizes_decodes_raw_once(self):
+        with mock.patch("core.tasks.Image.open", wraps=Image.open) as mock_open:
+            tasks.generate_sizes_for_photo(self.photo.id)
+
+        self.assertEqual(mock_open.call_count, 1)
+        self.assertEqual(self.photo.sizes.count(), Size.objects.count())
+
+    def test_empty_raw_reported_as_unreadable(self):
+        open(self.photo.raw_image.path, "wb").close()
+
+        with self.assertRaises(UnidentifiedImageError):
+            with tasks.open_raw(self.photo):
+                pass
+        self.assertIn("not a readable image", tasks.generate_sizes_for_photo(self.photo.id))
+        self.assertFalse(self.photo.sizes.exists())
+
+    def test_generate_sizes_dimensions(self):
+        tasks.generate_sizes_for_photo(self.photo.id)
+
+        original = self.photo.get_size("original")
+        self.assertEqual((original.width, original.height), (1200, 800))
+
+        large = self.photo.get_size("photoserv_ui_large")
+        self.assertEqual((large.width, large.height), (512, 341))
+
+        small = self.photo.get_size("photoserv_ui_small")
+        self.assertEqual((small.width, small.height), (128, 128))
+        with Image.open(small.image.path) as img:
+            self.assertEqual(img.size, (128, 128))
+
+    def test_generate_sizes_skips_existing(self):
+        tasks.generate_sizes_for_photo(self.photo.id)
+        md5s = dict(self.photo.sizes.values_list("size_id", "md5"))
+
+        with mock.patch("core.tasks.Image.open") as mock_open:
+            tasks.generate_sizes_for_photo(self.photo.id)
+
+        mock_open.assert_not_called()
+        self.assertEqual(dict(self.photo.sizes.values_list("size_id", "md5")), md5s)
+
+    @mock.patch("core.tasks._generate_photo_metadata")
+    @mock.patch("core.tasks.post_photo_create_sizes.delay")
+    def test_post_photo_create_renders_ui_sizes_first(self, mock_sizes, mock_metadata):
+        tasks.post_photo_create(self.photo.id)
+
+        self.assertEqual(
+            set(self.photo.sizes.values_list("size__slug", flat=True)),
+            {UI_THUMBNAIL_LARGE, UI_THUMBNAIL_SMALL}
+        )
+        mock_metadata.assert_called_once()
+        self.assertEqual(mock_metadata.call_args.args[0].id, self.photo.id)
+        mock_sizes.assert_called_once_with(self.photo.id)
+        self.assertIsNotNone(Photo.objects.get(pk=self.photo.pk).raw_md5)
+
+        tasks.post_photo_create_sizes(self.photo.id)
+        self.assertEqual(self.photo.sizes.count(), Size.objects.count())
+
+    @mock.patch("core.tasks.exiftool_metadata.get_metadata", return_value=[])
+    @mock.patch("core.tasks.post_photo_create_sizes.delay")
+    @override_settings(METADATA_BACKEND="pillow")
+    def test_post_photo_create_reads_raw_once(self, mock_sizes, mock_metadata):
+        real_open = open
+        with mock.patch("builtins.open", wraps=real_open) as mock_open:
+            tasks.post_photo_create(self.photo.id)
+
+        raw_opens = [c for c in mock_open.call_args_list if c.args[0] == self.photo.raw_image.path]
+        self.assertEqual(len(raw_opens), 1)
+
+    @mock.patch("core.tasks.exiftool_metadata.get_metadata", return_value=[])
+    @mock.patch("core.tasks.post_photo_create_sizes.delay")
+    @override_settings(METADATA_BACKEND="pillow", INGEST_SINGLE_READ=True)
+    def test_post_photo_create_single_read_renders_all_sizes(self, mock_sizes, mock_metadata):
+        real_open = open
+        with mock.patch("builtins.open", wraps=real_open) as mock_open:
+            tasks.post_photo_create(self.photo.id)
+
+        raw_opens = [c for c in mock_open.call_args_list if c.args[0] == self.photo.raw_image.path]
+        self.assertEqual(len(raw_opens), 1)
+        self.assertEqual(self.photo.sizes.count(), Size.objects.count())
+        self.assertTrue(Photo.objects.get(pk=self.photo.pk).published)
+        mock_sizes.assert_not_called()
+
+    def test_task_routes(self):
+        from photoserv.celery import app
+
+        def queue(name):
+            return app.amqp.router.route({}, name)["queue"].name
+
+        self.assertEqual(queue("core.tasks.post_photo_create"), "interactive")
+        self.assertEqual(queue("core.tasks.post_photo_create_sizes"), "sizes")
+        self.assertEqual(queue("core.tasks.regenerate_size_chunk"), "bulk")
+        self.assertEqual(queue("integration.tasks.call_web_request"), "integrations")
+
+    def test_generate_sizes_records_render_source(self):
+        tasks.generate_sizes_for_photo(self.photo.id)
+        self.photo.refresh_from_db()
+
+        with open(self.photo.raw_image.path, "rb") as f:
+            self.assertEqual(self.photo.raw_md5, hashlib.md5(f.read()).hexdigest())
+        for photo_size in self.photo.sizes.select_related("size"):
+            self.assertEqual(photo_size.source_md5, self.photo.raw_md5)
+            self.assertEqual(photo_size.size_fingerprint, photo_size.size.fingerprint)
+            self.assertFalse(photo_size.is_stale)
+
+    @mock.patch("core.tasks.generate_photo_sizes_for_size.delay_on_commit")
+    def test_generate_sizes_rerenders_stale_in_place(self, mock_regenerate):
+        tasks.generate_sizes_for_photo(self.photo.id)
+        size = Size.objects.get(slug="photoserv_ui_large")
+        old = self.photo.get_size(size.slug)
+
+        size.quality = 30
+        size.save()
+        with mock.patch("core.tasks.delete_files.delay_on_commit") as mock_delete:
+            tasks.generate_sizes_for_photo(self.photo.id)
+
+        new = self.photo.get_size(size.slug)
+        self.assertEqual(new.pk, old.pk)
+        self.assertNotEqual(new.md5, old.md5)
+        self.assertEqual(new.size_fingerprint, size.fingerprint)
+        mock_delete.assert_called_once_with([old.image.path])
+
+    def test_replaced_raw_rerenders_sizes(self):
+        tasks.generate_sizes_for_photo(self.photo.id)
+        self.photo.refresh_from_db()
+
+        with mock.patch("core.tasks.generate_sizes_for_photo.delay_on_commit") as mock_generate:
+            self.photo.raw_image = create_test_image_file("replacement.jpg", size=(900, 600))
+            self.photo.save()
+        mock_generate.assert_called_once_with(self.photo.id)
+        self.assertIsNone(self.photo.raw_md5)
+
+        tasks.generate_sizes_for_photo(self.photo.id)
+        original = self.photo.get_size("original")
+        self.assertEqual((original.width, original.height), (900, 600))
+        self.assertFalse(PhotoSize.objects.filter(PhotoSize.stale_filter(), photo=self.photo).exists())
+
+    def test_render_threads_produce_same_output(self):
+        sizes = list(Size.objects.exclude(slug="original"))
+        sizes.append(Size.objects.create(slug="medium", max_dimension=800, square_crop=True))
+
+        with override_settings(PHOTO_SIZE_RENDER_THREADS=1):
+            tasks.render_sizes(self.photo, sizes)
+        sequential = dict(self.photo.sizes.values_list("size_id", "md5"))
+        self.photo.sizes.all().delete()
+
+        with override_settings(PHOTO_SIZE_RENDER_THREADS=4):
+            tasks.render_sizes(self.photo, sizes)
+        parallel = dict(self.photo.sizes.values_list("size_id", "md5"))
+
+        self.assertEqual(len(parallel), len(sizes))
+        self.assertEqual(parallel, sequential)
+
+
+class ImageServingTests(TempMediaTestCase):
+    def setUp(self):
+        super().setUp()
+        self.photo = Photo.objects.create(title="Served", raw_image=create_test_image_file())
+        tasks.render_sizes(self.photo, [Size.objects.get(slug=UI_THUMBNAIL_SMALL)])
+        self.url = reverse("photo-image", kwargs={"pk": self.photo.pk, "size": UI_THUMBNAIL_SMALL})
+
+    def test_streams_file_by_default(self):
+        response = self.client.get(self.url)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn("X-Accel-Redirect", response)
+        with open(self.photo.get_size(UI_THUMBNAIL_SMALL).image.path, "rb") as f:
+            self.assertEqual(b"".join(response.streaming_content), f.read())
+
+    @override_settings(IMAGE_X_ACCEL_REDIRECT=True, IMAGE_X_ACCEL_LOCATION="/_protected_content/")
+    def test_x_accel_redirect_hands_file_to_nginx(self):
+        photo_size = self.photo.get_size(UI_THUMBNAIL_SMALL)
+
+        with mock.patch("django.db.models.fields.files.FieldFile.open") as mock_open:
+            response = self.client.get(self.url)
+
+        mock_open.assert_not_called()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response["X-Accel-Redirect"], f"/_protected_content/{photo_size.image.name}")
+        self.assertEqual(response["Content-Type"], "image/jpeg")
+        self.assertEqual(response.content, b"")
+
+    def test_validators_and_cache_headers(self):
+        response = self.client.get(self.url)
+
+        self.assertEqual(response["ETag"], f'"{self.photo.get_size(UI_THUMBNAIL_SMALL).md5}"')
+        self.assertIn("Last-Modified", response)
+        self.assertEqual(response["Cache-Control"], "private, no-cache")
+
+    def test_if_none_match_returns_304_without_opening_file(self):
+        etag = self.client.get(self.url)["ETag"]
+
+        with mock.patch("django.db.models.fields.files.FieldFile.open") as mock_open:
+            response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+
+        mock_open.assert_not_called()
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response["ETag"], etag)
+
+    def test_if_modified_since_returns_304(self):
+        last_modified = self.client.get(self.url)["Last-Modified"]
+
+        response = self.client.get(self.url, HTTP_IF_MODIFIED_SINCE=last_modified)
+        self.assertEqual(response.status_code, 304)
+
+    def test_changed_etag_returns_200(self):
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH='"stale"')
+        self.assertEqual(response.status_code, 200)
+
+    def test_missing_file_is_404(self):
+        os.remove(self.photo.get_size(UI_THUMBNAIL_SMALL).image.path)
+
+        self.assertEqual(self.client.get(self.url).status_code, 404)
+
+
+class RangeRequestTests(TempMediaTestCase):
+    def setUp(self):
+        super().setUp()
+        self.photo = Photo.objects.create(title="Ranged", raw_image=create_test_image_file())
+        tasks.render_sizes(self.photo, [Size.objects.get(slug="original")])
+        self.photo_size = self.photo.get_size("original")
+        with open(self.photo_size.image.path, "rb") as f:
+            self.data = f.read()
+        self.url = reverse("photo-image", kwargs={"pk": self.photo.pk, "size": "original"})
+
+    def get(self, range_header, **headers):
+        return self.client.get(self.url, HTTP_RANGE=range_header, **headers)
+
+    def test_full_response_advertises_ranges(self):
+        self.assertEqual(self.client.get(self.url)["Accept-Ranges"], "bytes")
+
+    def test_single_range(self):
+        response = self.get("bytes=10-19")
+
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response["Content-Range"], f"bytes 10-19/{len(self.data)}")
+        self.assertEqual(response["Content-Length"], "10")
+        self.assertEqual(b"".join(response.streaming_content), self.data[10:20])
+
+    def test_open_and_suffix_ranges(self):
+        response = self.get(f"bytes={len(self.data) - 5}-")
+        self.assertEqual(b"".join(response.streaming_content), self.data[-5:])
+
+        response = self.get("bytes=-7")
+        self.assertEqual(b"".join(response.streaming_content), self.data[-7:])
+
+    def test_multiple_ranges(self):
+        response = self.get("bytes=0-3,100-104")
+
+        self.assertEqual(response.status_code, 206)
+        self.assertTrue(response["Content-Type"].startswith("multipart/byteranges; boundary="))
+        body = b"".join(response.streaming_content)
+        self.assertEqual(len(body), int(response["Content-Length"]))
+        self.assertIn(b"Content-Range: bytes 0-3/" + str(len(self.data)).encode() + b"\r\n\r\n" + self.data[0:4], body)
+        self.assertIn(b"Content-Range: bytes 100-104/" + str(len(self.data)).encode() + b"\r\n\r\n" + self.data[100:105], body)
+
+    def test_overlapping_ranges_merged(self):
+        response = self.get("bytes=0-9,5-14")
+
+        self.assertEqual(response["Content-Range"], f"bytes 0-14/{len(self.data)}")
+
+    def test_unsatisfiable_range(self):
+        response = self.get(f"bytes={len(self.data) + 10}-")
+
+        self.assertEqual(response.status_code, 416)
+        self.assertEqual(response["Content-Range"], f"bytes */{len(self.data)}")
+
+    def test_malformed_range_ignored(self):
+        self.assertEqual(self.get("bytes=abc").status_code, 200)
+        self.assertEqual(self.get("lines=1-2").status_code, 200)
+
+    def test_if_range(self):
+        etag = f'"{self.photo_size.md5}"'
+        self.assertEqual(self.get("bytes=0-9", HTTP_IF_RANGE=etag).status_code, 206)
+        self.assertEqual(self.get("bytes=0-9", HTTP_IF_RANGE='"changed"').status_code, 200)
+
+        last_modified = self.client.get(self.url)["Last-Modified"]
+        self.assertEqual(self.get("bytes=0-9", HTTP_IF_RANGE=last_modified).status_code, 206)
+
+    @override_settings(IMAGE_X_ACCEL_REDIRECT=True)
+    def test_x_accel_leaves_ranges_to_nginx(self):
+        response = self.get("bytes=0-9")
+
+        self.assertEqual(response.status_code, 200)
+        self.assertIn("X-Accel-Redirect", response)
+
+
+class OutputFormatTests(TempMediaTestCase):
+    def setUp(self):
+        super().setUp()
+        self.photo = Photo.objects.create(title="Formats", raw_image=create_test_image_file())
+
+    def test_webp_size_renders_webp(self):
+        size = Size.objects.create(slug="webp", max_dimension=400, output_format=Size.OutputFormat.WEBP, quality=60)
+        tasks.render_sizes(self.photo, [size])
+
+        ps = self.photo.get_size("webp")
+        self.assertEqual(ps.format, Size.OutputFormat.WEBP)
+        self.assertEqual(ps.content_type, "image/webp")
+        self.assertTrue(ps.image.name.endswith(".webp"))
+        with Image.open(ps.image.path) as img:
+            self.assertEqual(img.format, "WEBP")
+
+    def test_jpeg_encoder_settings(self):
+        size = Size.objects.create(
+            slug="progressive", max_dimension=400, quality=90, progressive=True, optimize=True, subsampling="4:4:4"
+        )
+        tasks.render_sizes(self.photo, [size])
+
+        with Image.open(self.photo.get_size("progressive").image.path) as img:
+            self.assertEqual(img.format, "JPEG")
+            self.assertTrue(img.info.get("progressive"))
+
+    def test_jpeg_raw_not_passed_through_to_other_format(self):
+        size = Size.objects.create(slug="big-webp", max_dimension=5000, output_format=Size.OutputFormat.WEBP)
+        tasks.render_sizes(self.photo, [size])
+
+        with Image.open(self.photo.get_size("big-webp").image.path) as img:
+            self.assertEqual(img.format, "WEBP")
+
+    def test_image_view_serves_size_content_type(self):
+        size = Size.objects.create(slug="webp", max_dimension=400, output_format=Size.OutputFormat.WEBP)
+        tasks.render_sizes(self.photo, [size])
+
+        response = self.client.get(reverse("photo-image", kwargs={"pk": self.photo.pk, "size": "webp"}))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response["Content-Type"], "image/webp")
+
+    @mock.patch("core.models.features.check", return_value=False)
+    def test_clean_rejects_unsupported_format(self, mock_check):
+        size = Size(slug="avif", max_dimension=400, output_format=Size.OutputFormat.AVIF)
+        with self.assertRaises(ValidationError):
+            size.clean()
+        mock_check.assert_called_once_with("avif")
+
+    def test_jpeg_size_passes_validation(self):
+        size = Size(slug="jpeg", max_dimension=400, output_format=Size.OutputFormat.JPEG)
+        size.full_clean()
+
+        form = SizeForm(data={
+            "slug": "jpeg-form", "max_dimension": 400, "public": True, "draft_decode": True,
+            "output_format": Size.OutputFormat.JPEG, "quality": 75, "subsampling": "",
+        })
+        self.assertTrue(form.is_valid(), form.errors)
+
+
+@override_settings(PHOTO_SIZE_LAZY_RENDERING=True, CACHES=LOCMEM_CACHES)
+class LazyRenderingTests(TempMediaTestCase):
+    def setUp(self):
+        super().setUp()
+        self.photo = Photo.objects.create(title="Lazy", raw_image=create_test_image_file())
+        with mock.patch("core.tasks.generate_photo_sizes_for_size.delay_on_commit") as mock_regenerate:
+            self.size = Size.objects.create(slug="rare", max_dimension=300, public=True)
+        mock_regenerate.assert_not_called()
+
+    def test_missing_size_renders_on_request(self):
+        response = self.client.get(reverse("photo-image", kwargs={"pk": self.photo.pk, "size": "rare"}))
+
+        self.assertEqual(response.status_code, 200)
+        photo_size = self.photo.get_size("rare")
+        self.assertEqual((photo_size.width, photo_size.height), (300, 200))
+
+    def test_missing_size_not_rendered_when_disabled(self):
+        with override_settings(PHOTO_SIZE_LAZY_RENDERING=False):
+            response = self.client.get(reverse("photo-image", kwargs={"pk": self.photo.pk, "size": "rare"}))
+
+        self.assertEqual(response.status_code, 404)
+        self.assertIsNone(self.photo.get_size("rare"))
+
+    def test_stale_size_rerenders_on_request(self):
+        tasks.render_sizes(self.photo, [self.size])
+        self.size.max_dimension = 150
+        self.size.save()
+
+        photo_size = tasks.get_or_render_size(self.photo, "rare")
+        self.assertEqual((photo_size.width, photo_size.height), (150, 100))
+        self.assertFalse(photo_size.is_stale)
+
+    def test_public_only_skips_private_sizes(self):
+        self.size.public = False
+        self.size.save()
+
+        self.assertIsNone(tasks.get_or_render_size(self.photo, "rare", public_only=True))
+        self.assertIsNone(self.photo.get_size("rare"))
+
+    @mock.patch("core.tasks.LAZY_RENDER_WAIT", 0)
+    @mock.patch("core.tasks.render_sizes")
+    def test_locked_size_not_rendered_twice(self, mock_render):
+        cache.add(f"photoserv:render:{self.photo.id}:{self.size.id}", True)
+        try:
+            with self.assertRaises(tasks.RenderInProgress):
+                tasks.get_or_render_size(self.photo, "rare")
+
+            response = self.client.get(reverse("photo-image", kwargs={"pk": self.photo.pk, "size": "rare"}))
+            self.assertEqual(response.status_code, 503)
+            self.assertEqual(response["Retry-After"], str(tasks.LAZY_RENDER_RETRY_AFTER))
+        finally:
+            cache.clear()
+        mock_render.assert_not_called()
+
+    def test_expired_lock_not_released_by_previous_holder(self):
+        key = "photoserv:test:lock"
+        with tasks._cache_lock(key, timeout=60, wait=0):
+            # The lock expired and another holder took it
+            cache.set(key, "other holder")
+        self.assertEqual(cache.get(key), "other holder")
+
+        cache.delete(key)
+        with tasks._cache_lock(key, timeout=60, wait=0):
+            self.assertIsNotNone(cache.get(key))
+        self.assertIsNone(cache.get(key))
+
+    @mock.patch("core.tasks.RENDER_WRITE_LOCK_WAIT", 0)
+    def test_background_render_waits_for_write_lock(self):
+        cache.add(f"photoserv:render:write:{self.photo.id}:{self.size.id}", True)
+        try:
+            with self.assertRaises(TimeoutError):
+                tasks.generate_sizes_for_photo(self.photo.id, size_ids=[self.size.id])
+        finally:
+            cache.clear()
+        self.assertIsNone(self.photo.get_size("rare"))
+
+
+@mock.patch("core.metadata.exiftool.ExifToolHelper")
+class PersistentExifToolTests(TestCase):
+    def setUp(self):
+        metadata.shutdown()
+
+    def tearDown(self):
+        metadata.shutdown()
+
+    def test_process_reused_across_reads(self, mock_helper):
+        mock_helper.return_value.get_metadata.return_value = [{}]
+
+        metadata.get_metadata("a.jpg")
+        metadata.get_metadata("b.jpg")
+
+        mock_helper.assert_called_once_with(common_args=["-G"])
+        mock_helper.return_value.run.assert_called_once()
+        self.assertEqual(mock_helper.return_value.get_metadata.call_count, 2)
+
+    def test_dead_process_restarted(self, mock_helper):
+        dead, alive = mock.Mock(running=False), mock.Mock(running=True)
+        mock_helper.side_effect = [dead, alive]
+
+        metadata.get_metadata("a.jpg")
+        metadata.get_metadata("b.jpg")
+
+        self.assertEqual(mock_helper.call_count, 2)
+        alive.get_metadata.assert_called_once_with(["b.jpg"], None)
+
+    def test_crash_during_read_retried(self, mock_helper):
+        crashed = mock.Mock(running=False)
+        crashed.get_metadata.side_effect = ExifToolException("died")
+        alive = mock.Mock(running=True)
+        alive.get_metadata.return_value = [{"EXIF:Make": "Nikon"}]
+        mock_helper.side_effect = [crashed, alive]
+
+        self.assertEqual(metadata.get_metadata("a.jpg"), [{"EXIF:Make": "Nikon"}])
+
+    def test_read_error_not_retried(self, mock_helper):
+        mock_helper.return_value.running = True
+        mock_helper.return_value.get_metadata.side_effect = ExifToolException("bad file")
+
+        with self.assertRaises(ExifToolException):
+            metadata.get_metadata("a.jpg")
+        mock_helper.assert_called_once()
+
+    def test_process_not_shared_after_fork(self, mock_helper):
+        metadata.get_exiftool()
+        with mock.patch("core.metadata.os.getpid", return_value=-1):
+            metadata.get_exiftool()
+
+        self.assertEqual(mock_helper.call_count, 2)
+        mock_helper.return_value.terminate.assert_not_called()
+
+
+@mock.patch("core.tasks.exiftool_metadata.get_metadata")
+class MetadataBatchTests(TempMediaTestCase):
+    def setUp(self):
+        super().setUp()
+        self.photos = [Photo.objects.create(title=f"P{i}", raw_image=create_test_image_file(f"{i}.jpg")) for i in range(3)]
+
+    def exiftool_output(self, files, params):
+        return [
+            {"SourceFile": path, tasks.METADATA_EXIF_MAKE: "Nikon", tasks.METADATA_EXIF_ISO: 100 * (i + 1)}
+            for i, path in enumerate(files)
+        ]
+
+    def test_batch_reads_all_photos_in_one_call(self, mock_get_metadata):
+        mock_get_metadata.side_effect = self.exiftool_output
+        PhotoMetadata.objects.create(photo=self.photos[0], camera_make="Old")
+
+        tasks.generate_photo_metadata_batch([photo.id for photo in self.photos])
+
+        mock_get_metadata.assert_called_once()
+        self.assertEqual(PhotoMetadata.objects.count(), 3)
+        self.assertEqual(set(PhotoMetadata.objects.values_list("camera_make", flat=True)), {"Nikon"})
+        self.assertEqual(PhotoMetadata.objects.get(photo=self.photos[2]).iso, 300)
+
+    def test_batch_skips_missing_raw_files(self, mock_get_metadata):
+        mock_get_metadata.side_effect = self.exiftool_output
+        os.remove(self.photos[1].raw_image.path)
+
+        tasks.generate_photo_metadata_batch([photo.id for photo in self.photos])
+
+        self.assertEqual(len(mock_get_metadata.call_args.args[0]), 2)
+        self.assertFalse(PhotoMetadata.objects.filter(photo=self.photos[1]).exists())
+
+    def test_unreadable_file_falls_back_to_single_reads(self, mock_get_metadata):
+        corrupt = self.photos[1].raw_image.path
+
+        def exiftool(files, params):
+            if corrupt in files:
+                raise ExifToolExecuteError(1, "", "File format error", params)
+            return self.exiftool_output(files, params)
+        mock_get_metadata.side_effect = exiftool
+
+        with self.assertLogs("core.tasks", level="WARNING"):
+            tasks.generate_photo_metadata_batch([photo.id for photo in self.photos])
+
+        self.assertEqual(mock_get_metadata.call_count, 4)
+        self.assertEqual(PhotoMetadata.objects.get(photo=self.photos[0]).camera_make, "Nikon")
+        self.assertEqual(PhotoMetadata.objects.get(photo=self.photos[2]).camera_make, "Nikon")
+        # Marked with empty metadata so consistency doesn't queue it again
+        self.assertIsNone(PhotoMetadata.objects.get(photo=self.photos[1]).camera_make)
+
+    @mock.patch("core.tasks.METADATA_BATCH_SIZE", 2)
+    @mock.patch("core.tasks.generate_photo_metadata_batch.delay")
+    def test_consistency_batches_missing_metadata(self, mock_batch, mock_get_metadata):
+        with mock.patch("core.tasks.generate_sizes_for_photos.apply_async"):
+            tasks.consistency()
+
+        ids = [photo.id for photo in self.photos]
+        self.assertEqual(mock_batch.call_args_list, [mock.call(ids[:2]), mock.call(ids[2:])])
+
+
+@override_settings(METADATA_BACKEND="pillow")
+@mock.patch("core.tasks.exiftool_metadata.get_metadata")
+class PillowMetadataTests(TempMediaTestCase):
+    def create_photo(self, lens=True, exif=True, **overrides):
+        from PIL.ExifTags import Base, IFD
+        from PIL.TiffImagePlugin import IFDRational
+
+        image = Image.new("RGB", (64, 64), color="red")
+        exif_data = Image.Exif()
+        if exif:
+            exif_data[Base.Make] = "Nikon"
+            exif_data[Base.Model] = "Z 6"
+            exif_data[Base.Copyright] = "Me"
+            details = exif_data.get_ifd(IFD.Exif)
+            details[Base.DateTimeOriginal] = "2024:05:01 10:20:30"
+            details[Base.FNumber] = IFDRational(28, 10)
+            details[Base.ExposureTime] = IFDRational(1, 250)
+            details[Base.ISOSpeedRatings] = 400
+            details[Base.FocalLength] = IFDRational(50, 1)
+            details[Base.FocalLengthIn35mmFilm] = 50
+            details[Base.ExposureProgram] = 3
+            details[Base.Flash] = 0x10
+            if lens:
+                details[Base.LensModel] = "NIKKOR Z 50mm f/1.8 S"
+            for tag, value in overrides.items():
+                details[getattr(Base, tag)] = value
+
+        file = io.BytesIO()
+        image.save(file, "JPEG", exif=exif_data, xmp=b'<x:xmpmeta><rdf:Description xmp:Rating="4"/></x:xmpmeta>')
+        raw = SimpleUploadedFile("exif.jpg", file.getvalue(), content_type="image/jpeg")
+        return Photo.objects.create(title="Exif", raw_image=raw)
+
+    def test_standard_exif_read_in_process(self, mock_get_metadata):
+        photo = self.create_photo()
+        mock_get_metadata.return_value = []
+
+        tasks.generate_photo_metadata(photo.id)
+
+        # A fully tagged JPEG needs no ExifTool process
+        mock_get_metadata.assert_not_called()
+        metadata = PhotoMetadata.objects.get(photo=photo)
+        self.assertEqual((metadata.camera_make, metadata.camera_model), ("Nikon", "Z 6"))
+        self.assertEqual(metadata.lens_model, "NIKKOR Z 50mm f/1.8 S")
+        self.assertEqual(metadata.capture_date.replace(tzinfo=None), datetime(2024, 5, 1, 10, 20, 30))
+        self.assertEqual((metadata.aperture, metadata.shutter_speed, metadata.iso), (2.8, 0.004, 400))
+        self.assertEqual((metadata.focal_length, metadata.focal_length_35mm), (50.0, 50.0))
+        self.assertEqual(metadata.exposure_program, "Aperture-priority AE")
+        self.assertEqual(metadata.flash, "Off, Did not fire")
+        self.assertEqual(metadata.copyright, "Me")
+        self.assertEqual(metadata.rating, 4)
+
+    def test_exiftool_reads_only_missing_composites(self, mock_get_metadata):
+        photo = self.create_photo(lens=False)
+        path = photo.raw_image.path
+        mock_get_metadata.return_value = [{"SourceFile": path, tasks.METADATA_COMPOSITE_LENS_ID: "AF-S 50mm"}]
+
+        tasks.generate_photo_metadata(photo.id)
+
+        mock_get_metadata.assert_called_once_with([path], [f"-{tasks.METADATA_COMPOSITE_LENS_ID}", "-fast"])
+        metadata = PhotoMetadata.objects.get(photo=photo)
+        self.assertEqual(metadata.lens_model, "AF-S 50mm")
+        self.assertEqual(metadata.camera_make, "Nikon")
+
+    def test_unknown_35mm_focal_length_left_to_exiftool(self, mock_get_metadata):
+        photo = self.create_photo(FocalLengthIn35mmFilm=0)
+        path = photo.raw_image.path
+        mock_get_metadata.return_value = [{"SourceFile": path, tasks.METADATA_EXIF_FOCAL_LENGTH_35MM: 75.0}]
+
+        tasks.generate_photo_metadata(photo.id)
+
+        mock_get_metadata.assert_called_once_with([path], [f"-{tasks.METADATA_EXIF_FOCAL_LENGTH_35MM}#", "-fast"])
+        self.assertEqual(PhotoMetadata.objects.get(photo=photo).focal_length_35mm, 75.0)
+
+    def test_malformed_flash_skipped(self, mock_get_metadata):
+        from PIL.TiffImagePlugin import IFDRational
+
+        photo = self.create_photo(Flash=IFDRational(1, 3))
+        mock_get_metadata.return_value = []
+
+        tasks.generate_photo_metadata(photo.id)
+
+        metadata = PhotoMetadata.objects.get(photo=photo)
+        self.assertIsNone(metadata.flash)
+        self.assertEqual(metadata.camera_make, "Nikon")
+
+    def test_exiftool_reads_files_without_exif(self, mock_get_metadata):
+        photo = self.create_photo(exif=False)
+        path = photo.raw_image.path
+        mock_get_metadata.return_value = [{"SourceFile": path, tasks.METADATA_EXIF_MAKE: "Canon"}]
+
+        tasks.generate_photo_metadata(photo.id)
+
+        mock_get_metadata.assert_called_once_with([path], tasks.METADATA_TAGS)
+        self.assertEqual(PhotoMetadata.objects.get(photo=photo).camera_make, "Canon")
+
+
+class PassthroughSizeTests(TempMediaTestCase):
+    def setUp(self):
+        super().setUp()
+        self.original = Size.objects.get(slug="original")
+
+    def test_original_reuses_raw_bytes_without_decode(self):
+        photo = Photo.objects.create(title="Pass", raw_image=create_test_image_file())
+
+        with mock.patch("core.tasks._resize_to_fit") as mock_resize:
+            tasks.render_sizes(photo, [self.original])
+        mock_resize.assert_not_called()
+
+        ps = photo.get_size("original")
+        with open(photo.raw_image.path, "rb") as f:
+            raw_bytes = f.read()
+        with open(ps.image.path, "rb") as f:
+            self.assertEqual(f.read(), raw_bytes)
+        self.assertNotEqual(ps.image.path, photo.raw_image.path)
+        self.assertEqual(ps.md5, hashlib.md5(raw_bytes).hexdigest())
+        self.assertEqual((ps.width, ps.height), (1200, 800))
+
+    @mock.patch("core.tasks.os.link", side_effect=OSError("cross-device link"))
+    def test_original_copied_from_mapped_raw_without_hardlink(self, mock_link):
+        photo = Photo.objects.create(title="Pass", raw_image=create_test_image_file())
+        tasks.render_sizes(photo, [self.original])
+
+        with open(photo.raw_image.path, "rb") as raw, open(photo.get_size("original").image.path, "rb") as f:
+            self.assertEqual(f.read(), raw.read())
+
+    def test_deleting_size_file_keeps_raw(self):
+        photo = Photo.objects.create(title="Pass", raw_image=create_test_image_file())
+        tasks.render_sizes(photo, [self.original])
+
+        tasks.delete_files([photo.get_size("original").image.path])
+        self.assertTrue(os.path.isfile(photo.raw_image.path))
+
+    def test_encoder_settings_reencode_raw(self):
+        size = Size.objects.create(slug="progressive", max_dimension=10000, quality=60, progressive=True)
+        photo = Photo.objects.create(title="Encoded", raw_image=create_test_image_file())
+
+        tasks.render_sizes(photo, [size])
+
+        photo_size = photo.get_size("progressive")
+        self.assertNotEqual(photo_size.md5, photo.raw_md5)
+        with Image.open(photo_size.image.path) as img:
+            self.assertTrue(img.info.get("progressive"))
+
+    def test_non_jpeg_raw_is_reencoded(self):
+        file = io.BytesIO()
+        Image.new("RGB", (300, 200), color="blue").save(file, "PNG")
+        photo = Photo.objects.create(
+            title="Png",
+            raw_image=SimpleUploadedFile("test.png", file.getvalue(), content_type="image/png"),
+        )
+
+        tasks.render_sizes(photo, [self.original])
+
+        with Image.open(photo.get_size("original").image.path) as img:
+            self.assertEqual(img.format, "JPEG")
+
+
+class DraftDecodeTests(TempMediaTestCase):
+    def setUp(self):
+        super().setUp()
+        self.photo = Photo.objects.create(title="Draft Me", raw_image=create_test_image_file(size=(2048, 1536)))
+        self.small = Size.objects.get(slug="photoserv_ui_small")
+
+    def _decoded_size(self, sizes):
+        with mock.patch("core.tasks._resize_to_fit", wraps=tasks._resize_to_fit) as mock_resize:
+            tasks.render_sizes(self.photo, sizes)
+        return mock_resize.call_args_list[0].args[0].size
+
+    def test_small_size_uses_reduced_decode(self):
+        # 128px target, decoded at no less than 2x -> 1/8 scale
+        self.assertEqual(self._decoded_size([self.small]), (256, 192))
+        ps = self.photo.get_size(self.small.slug)
+        self.assertEqual((ps.width, ps.height), (128, 128))
+
+    def test_draft_decode_disabled_on_size(self):
+        self.small.draft_decode = False
+        self.assertEqual(self._decoded_size([self.small]), (2048, 1536))
+
+    def test_large_size_prevents_reduced_decode(self):
+        large = Size.objects.create(slug="large", max_dimension=1800)
+        self.assertEqual(self._decoded_size([large, self.small]), (2048, 1536))
+
+
 class CommonEntityTests(TestCase):
     def test_created_at_and_updated_at(self):
         album = Album.objects.create(title="Album", description="desc")
@@ -545,6 +1419,433 @@ class PhotoPublishStateTests(TestCase):
         mock_unpub.assert_not_called()
 
 
+@mock.patch("core.tasks.generate_photo_metadata_batch.delay")
+@mock.patch("core.tasks.generate_sizes_for_photos.apply_async")
+@mock.patch("core.tasks.delete_files.delay")
+@override_settings(CACHES=LOCMEM_CACHES)
+class ConsistencyTests(TempMediaTestCase):
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+        self.photo = Photo.objects.create(title="Consistent", raw_image=create_test_image_file())
+        tasks.render_sizes(self.photo, list(Size.objects.all()))
+        self.resized_dir = os.path.join(self.media_root, CONTENT_RESIZED_PHOTOS_PATH)
+
+    def write_file(self, name, age=3600):
+        path = os.path.join(self.resized_dir, name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "wb") as f:
+            f.write(b"stray")
+        mtime = time.time() - age
+        os.utime(path, (mtime, mtime))
+        return path
+
+    def test_consistent_library(self, mock_delete, mock_generate, mock_metadata):
+        PhotoMetadata.objects.create(photo=self.photo)
+
+        self.assertEqual(tasks.consistency(), "No issues found.")
+        mock_delete.assert_not_called()
+        mock_generate.assert_not_called()
+
+    def test_missing_file_deletes_size_and_regenerates(self, mock_delete, mock_generate, mock_metadata):
+        photo_size = self.photo.get_size("original")
+        os.remove(photo_size.image.path)
+
+        tasks.consistency()
+
+        self.assertFalse(PhotoSize.objects.filter(pk=photo_size.pk).exists())
+        mock_generate.assert_called_once_with(([self.photo.id],), queue="bulk")
+
+    @mock.patch("core.tasks.generate_photo_sizes_for_size.delay")
+    def test_changed_size_regenerated_once(self, mock_regenerate, mock_delete, mock_generate, mock_metadata):
+        PhotoMetadata.objects.create(photo=self.photo)
+        other = Photo.objects.create(title="Other", raw_image=create_test_image_file())
+        PhotoMetadata.objects.create(photo=other)
+        tasks.render_sizes(other, list(Size.objects.all()))
+        size = Size.objects.get(slug="original")
+        PhotoSize.objects.filter(size=size).update(size_fingerprint="outdated")
+
+        tasks.consistency()
+
+        mock_regenerate.assert_called_once_with(size.id)
+        mock_generate.assert_not_called()
+
+        # Left alone while its regeneration is still running
+        mock_regenerate.reset_mock()
+        SizeRegeneration.objects.create(size=size)
+        tasks.consistency()
+        mock_regenerate.assert_not_called()
+        mock_generate.assert_not_called()
+
+    @mock.patch("core.tasks.generate_photo_sizes_for_size.delay")
+    def test_finished_regeneration_not_restarted_for_leftovers(self, mock_regenerate, mock_delete, mock_generate, mock_metadata):
+        PhotoMetadata.objects.create(photo=self.photo)
+        size = Size.objects.get(slug="original")
+        PhotoSize.objects.filter(size=size).update(size_fingerprint="outdated")
+        # Finished for the current spec, but this photo's raw couldn't be rendered
+        SizeRegeneration.objects.create(size=size, fingerprint=size.fingerprint, finished_at=timezone.now())
+
+        tasks.consistency()
+
+        mock_regenerate.assert_not_called()
+        mock_generate.assert_called_once_with(([self.photo.id],), queue="bulk")
+
+        # A regeneration of an earlier spec is restarted
+        mock_generate.reset_mock()
+        SizeRegeneration.objects.filter(size=size).update(fingerprint="earlier")
+        tasks.consistency()
+        mock_regenerate.assert_called_once_with(size.id)
+        mock_generate.assert_not_called()
+
+    def test_replaced_raw_rerenders_photo(self, mock_delete, mock_generate, mock_metadata):
+        PhotoMetadata.objects.create(photo=self.photo)
+        Photo.objects.filter(pk=self.photo.pk).update(raw_md5="0" * 32)
+
+        tasks.consistency()
+
+        mock_generate.assert_called_once_with(([self.photo.id],), queue="bulk")
+
+    def test_stray_files_deleted_after_grace_period(self, mock_delete, mock_generate, mock_metadata):
+        old = self.write_file("old-stray.jpg")
+        nested = self.write_file(os.path.join("ab", "cd", "nested-stray.jpg"))
+        self.write_file("new-stray.jpg", age=0)
+
+        tasks.consistency()
+
+        self.assertEqual(sorted(path for call in mock_delete.call_args_list for path in call.args[0]), sorted([nested, old]))
+
+    @override_settings(SIZE_REGENERATION_CHUNK_SIZE=2)
+    def test_incomplete_photos_queued_in_batches(self, mock_delete, mock_generate, mock_metadata):
+        photos = [self.photo] + [
+            Photo.objects.create(title=f"Unrendered {i}", raw_image=create_test_image_file()) for i in range(4)
+        ]
+        for photo in photos:
+            PhotoMetadata.objects.get_or_create(photo=photo)
+        # Photos with a replaced raw are queued once, by the replaced raw check
+        tasks.render_sizes(photos[1], [Size.objects.get(slug="original")])
+        Photo.objects.filter(pk=photos[1].pk).update(raw_md5="0" * 32)
+
+        tasks.consistency()
+
+        ids = [photo.id for photo in photos]
+        self.assertEqual(
+            mock_generate.call_args_list,
+            [mock.call(([ids[1]],), queue="bulk"), mock.call((ids[2:4],), queue="bulk"), mock.call((ids[4:],), queue="bulk")],
+        )
+
+    @mock.patch("core.tasks.CONSISTENCY_MAX_RENDERS", 2)
+    @mock.patch("core.tasks.CONSISTENCY_CHUNK_SIZE", 2)
+    def test_render_budget_resumes_next_run(self, mock_delete, mock_generate, mock_metadata):
+        PhotoMetadata.objects.create(photo=self.photo)
+        photos = [Photo.objects.create(title=f"Unrendered {i}", raw_image=create_test_image_file()) for i in range(3)]
+        for photo in photos:
+            PhotoMetadata.objects.create(photo=photo)
+
+        self.assertIn("resuming next run", tasks.consistency())
+        self.assertEqual([call.args[0][0] for call in mock_generate.call_args_list], [[photos[0].id, photos[1].id]])
+        self.assertEqual(cache.get(tasks.CONSISTENCY_CHECKPOINT_KEY), {"incomplete_photos": photos[1].id})
+
+        mock_generate.reset_mock()
+        self.assertEqual(tasks.consistency(), "Identified and queued fixes for 1 issues.")
+        self.assertEqual([call.args[0][0] for call in mock_generate.call_args_list], [[photos[2].id]])
+        self.assertEqual(cache.get(tasks.CONSISTENCY_CHECKPOINT_KEY), {})
+
+    @mock.patch("core.tasks.CONSISTENCY_CHUNK_SIZE", 1)
+    @mock.patch("core.tasks.CONSISTENCY_TIME_BUDGET", 0)
+    def test_missing_metadata_resumes_from_checkpoint(self, mock_delete, mock_generate, mock_metadata):
+        others = [Photo.objects.create(title=f"Other {i}", raw_image=create_test_image_file()) for i in range(2)]
+        for photo in others:
+            tasks.render_sizes(photo, list(Size.objects.all()))
+
+        tasks.consistency()
+        self.assertEqual(mock_metadata.call_args_list, [mock.call([self.photo.id])])
+        self.assertEqual(cache.get(tasks.CONSISTENCY_CHECKPOINT_KEY)["missing_metadata"], self.photo.id)
+
+        tasks.consistency()
+        self.assertEqual(mock_metadata.call_args_list[-1], mock.call([others[0].id]))
+
+    @mock.patch("core.tasks.CONSISTENCY_CHUNK_SIZE", 1)
+    @mock.patch("core.tasks.CONSISTENCY_TIME_BUDGET", 0)
+    def test_resumes_from_checkpoint(self, mock_delete, mock_generate, mock_metadata):
+        strays = sorted(self.write_file(f"stray-{i}.jpg") for i in range(3))
+        size_count = PhotoSize.objects.count()
+
+        self.assertIn("resuming next run", tasks.consistency())
+        runs = 1
+        while cache.get(tasks.CONSISTENCY_CHECKPOINT_KEY):
+            tasks.consistency()
+            runs += 1
+            self.assertLess(runs, 50)
+
+        # Each run makes one chunk of progress until both walks complete
+        self.assertEqual(runs, max(size_count, len(strays)) + 1)
+        self.assertEqual(PhotoSize.objects.count(), size_count)
+        self.assertEqual([call.args[0] for call in mock_delete.call_args_list], [[path] for path in strays])
+
+
+class ShardedContentTests(TempMediaTestCase):
+    def setUp(self):
+        super().setUp()
+        self.photo = Photo.objects.create(title="Sharded", raw_image=create_test_image_file())
+        tasks.render_sizes(self.photo, [Size.objects.get(slug=UI_THUMBNAIL_SMALL)])
+
+    def assert_sharded(self, name, base):
+        shard1, shard2, filename = os.path.relpath(name, base).split(os.sep)
+        self.assertEqual(os.path.join(base, shard1, shard2, filename), sharded_path(base, filename))
+
+    def test_new_files_are_sharded(self):
+        self.assert_sharded(self.photo.raw_image.name, CONTENT_RAW_PHOTOS_PATH)
+        self.assert_sharded(self.photo.get_size(UI_THUMBNAIL_SMALL).image.name, CONTENT_RESIZED_PHOTOS_PATH)
+
+    def flatten(self, instance, field, base):
+        file = getattr(instance, field)
+        flat_name = os.path.join(base, os.path.basename(file.name))
+        os.rename(file.path, os.path.join(self.media_root, flat_name))
+        type(instance).objects.filter(pk=instance.pk).update(**{field: flat_name})
+        return flat_name
+
+    def test_shard_content_moves_flat_files(self):
+        photo_size = self.photo.get_size(UI_THUMBNAIL_SMALL)
+        with open(photo_size.image.path, "rb") as f:
+            data = f.read()
+        flat_raw = self.flatten(self.photo, "raw_image", CONTENT_RAW_PHOTOS_PATH)
+        flat_size = self.flatten(photo_size, "image", CONTENT_RESIZED_PHOTOS_PATH)
+        old_mtime = time.time() - 3600
+        os.utime(os.path.join(self.media_root, flat_size), (old_mtime, old_mtime))
+
+        call_command("shard_content", "--dry-run", stdout=io.StringIO())
+        self.assertTrue(os.path.isfile(os.path.join(self.media_root, flat_raw)))
+
+        out = io.StringIO()
+        call_command("shard_content", "--batch-size", "1", stdout=out)
+
+        self.assertIn("Moved 1 photo files.", out.getvalue())
+        self.photo.refresh_from_db()
+        photo_size.refresh_from_db()
+        self.assert_sharded(self.photo.raw_image.name, CONTENT_RAW_PHOTOS_PATH)
+        self.assert_sharded(photo_size.image.name, CONTENT_RESIZED_PHOTOS_PATH)
+        self.assertFalse(os.path.exists(os.path.join(self.media_root, flat_raw)))
+        self.assertFalse(os.path.exists(os.path.join(self.media_root, flat_size)))
+        with open(photo_size.image.path, "rb") as f:
+            self.assertEqual(f.read(), data)
+        # Within the consistency grace period until its row points at it
+        self.assertGreater(os.path.getmtime(photo_size.image.path), time.time() - tasks.CONSISTENCY_GRACE_PERIOD)
+
+        # Already sharded files are left alone
+        out = io.StringIO()
+        call_command("shard_content", stdout=out)
+        self.assertIn("Moved 0 photo files.", out.getvalue())
+
+
+@override_settings(CONTENT_DEDUPLICATION=True)
+class DeduplicatedContentTests(TempMediaTestCase):
+    def setUp(self):
+        super().setUp()
+        self.photos = [
+            Photo.objects.create(title=f"Duplicate {i}", raw_image=create_test_image_file())
+            for i in range(2)
+        ]
+        self.size = Size.objects.get(slug=UI_THUMBNAIL_SMALL)
+        for photo in self.photos:
+            tasks.render_sizes(photo, [self.size])
+
+    def test_identical_files_stored_once(self):
+        first, second = self.photos
+        self.assertEqual(first.raw_image.name, second.raw_image.name)
+        self.assertEqual(first.raw_image.name, content_addressed_path(CONTENT_RAW_PHOTOS_PATH, first.raw_md5, ".jpg"))
+        self.assertEqual(first.get_size(UI_THUMBNAIL_SMALL).image.name, second.get_size(UI_THUMBNAIL_SMALL).image.name)
+        self.assertEqual(len(os.listdir(os.path.dirname(first.raw_image.path))), 1)
+
+    def test_different_content_stored_separately(self):
+        photo = Photo.objects.create(title="Different", raw_image=create_test_image_file(size=(600, 400)))
+
+        self.assertNotEqual(photo.raw_image.name, self.photos[0].raw_image.name)
+        self.assertTrue(os.path.isfile(photo.raw_image.path))
+
+    def test_files_deleted_with_last_reference(self):
+        first, second = self.photos
+        raw_path = first.raw_image.path
+        size_path = first.get_size(UI_THUMBNAIL_SMALL).image.path
+
+        first.delete()
+        tasks.delete_files([raw_path, size_path])
+        self.assertTrue(os.path.isfile(raw_path))
+        self.assertTrue(os.path.isfile(size_path))
+
+        second.delete()
+        self.assertEqual(tasks.delete_files([raw_path, size_path]), "Deleted 2 files.")
+        self.assertFalse(os.path.isfile(raw_path))
+        self.assertFalse(os.path.isfile(size_path))
+
+    def test_delete_files_accepts_storage_names(self):
+        name = self.photos[0].get_size(UI_THUMBNAIL_SMALL).image.name
+        PhotoSize.objects.filter(image=name).delete()
+
+        tasks.delete_files([name])
+
+        self.assertFalse(os.path.isfile(os.path.join(self.media_root, name)))
+
+    def test_delete_files_rechecks_references_under_content_lock(self):
+        first, second = self.photos
+        raw_path = first.raw_image.path
+        Photo.objects.filter(pk__in=[first.pk, second.pk]).delete()
+        content_lock = tasks.content_lock
+
+        @contextmanager
+        def reused_while_waiting(digest):
+            with content_lock(digest):
+                # An upload of the same bytes saved its row while delete_files waited
+                Photo.objects.create(title="Reupload", raw_image=first.raw_image.name)
+                yield
+
+        with mock.patch("core.tasks.content_lock", reused_while_waiting):
+            self.assertEqual(tasks.delete_files([raw_path]), "Deleted 0 files.")
+        self.assertTrue(os.path.isfile(raw_path))
+
+    @mock.patch("core.tasks.CONTENT_LOCK_WAIT", 0)
+    def test_duplicate_upload_waits_for_content_lock(self):
+        with tasks.content_lock(self.photos[0].raw_md5):
+            with self.assertRaises(TimeoutError):
+                Photo.objects.create(title="Duplicate 2", raw_image=create_test_image_file())
+
+    def test_linked_size_replaces_partial_file(self):
+        full = Size.objects.create(slug="full", max_dimension=10000)
+        first, second = self.photos
+        tasks.render_sizes(first, [full])
+        path = first.get_size("full").image.path
+        with open(first.raw_image.path, "rb") as f:
+            raw = f.read()
+        # Left by a copy interrupted before the atomic write
+        os.remove(path)
+        with open(path, "wb") as f:
+            f.write(raw[:10])
+
+        tasks.render_sizes(second, [full])
+
+        self.assertEqual(second.get_size("full").image.path, path)
+        with open(path, "rb") as f:
+            self.assertEqual(f.read(), raw)
+        self.assertEqual(os.listdir(os.path.dirname(path)), [os.path.basename(path)])
+
+
+class PublishPhotosTaskTests(TestCase):
+    def setUp(self):
+        Size.objects.all().delete()
+        self.size = Size.objects.create(slug="only", max_dimension=100)
+
+    def create_photo(self, with_size=True, **kwargs):
+        photo = Photo.objects.create(title=f"Scheduled {Photo.objects.count()}", **kwargs)
+        if with_size:
+            PhotoSize.objects.create(photo=photo, size=self.size, image="x.jpg", height=1, width=1, md5="0")
+        return photo
+
+    @mock.patch("core.signals.photo_published.send")
+    @mock.patch("core.signals.photo_unpublished.send")
+    def test_only_transitions_dispatch(self, mock_unpub, mock_pub):
+        due = self.create_photo(publish_date=timezone.now() - timedelta(minutes=1))
+        hidden = self.create_photo(hidden=True, _published=True)
+        self.create_photo(publish_date=timezone.now() + timedelta(days=1))
+        self.create_photo(_published=True)
+
+        self.assertEqual(tasks.publish_photos(), "2 photos published/unpublished, 0 scheduled.")
+
+        self.assertTrue(Photo.objects.get(pk=due.pk).published)
+        self.assertFalse(Photo.objects.get(pk=hidden.pk).published)
+        self.assertEqual(mock_pub.call_count, 1)
+        self.assertEqual(mock_unpub.call_count, 1)
+
+    def test_incomplete_sizes_wait(self):
+        photo = self.create_photo(with_size=False)
+
+        tasks.publish_photos()
+        self.assertFalse(Photo.objects.get(pk=photo.pk).published)
+
+        with override_settings(PHOTO_SIZE_LAZY_RENDERING=True):
+            tasks.publish_photos()
+        self.assertTrue(Photo.objects.get(pk=photo.pk).published)
+
+    def test_query_count_independent_of_library_size(self):
+        for _ in range(20):
+            self.create_photo(_published=True)
+
+        with self.assertNumQueries(3):
+            tasks.publish_photos()
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class ScheduledPublishTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        Size.objects.all().delete()
+
+    @mock.patch("core.tasks.publish_photo.apply_async_on_commit")
+    def test_save_schedules_publish_at_publish_date(self, mock_schedule):
+        publish_date = timezone.now() + timedelta(minutes=5)
+        photo = Photo.objects.create(title="Soon", publish_date=publish_date)
+
+        mock_schedule.assert_called_once_with((photo.id, publish_date.isoformat()), eta=publish_date)
+
+        # Saving again with the same date doesn't schedule a duplicate
+        photo.title = "Renamed"
+        photo.save()
+        self.assertEqual(mock_schedule.call_count, 1)
+
+        photo.publish_date = publish_date + timedelta(minutes=1)
+        photo.save()
+        self.assertEqual(mock_schedule.call_count, 2)
+
+    @mock.patch("core.tasks.publish_photo.apply_async_on_commit")
+    def test_not_scheduled_when_hidden_or_beyond_horizon(self, mock_schedule):
+        Photo.objects.create(title="Hidden", hidden=True, publish_date=timezone.now() + timedelta(minutes=5))
+        Photo.objects.create(title="Later", publish_date=timezone.now() + timedelta(days=7))
+        Photo.objects.create(title="Now")
+
+        mock_schedule.assert_not_called()
+
+    @mock.patch("core.tasks.publish_photo.apply_async_on_commit")
+    def test_publish_photos_schedules_photos_coming_due(self, mock_schedule):
+        later = timezone.now() + timedelta(days=7)
+        photo = Photo.objects.create(title="Later", publish_date=later)
+        soon = timezone.now() + timedelta(minutes=5)
+        Photo.objects.filter(pk=photo.pk).update(publish_date=soon)
+
+        self.assertIn("1 scheduled", tasks.publish_photos())
+        self.assertIn("0 scheduled", tasks.publish_photos())
+        mock_schedule.assert_called_once_with((photo.id, soon.isoformat()), eta=soon)
+
+    @mock.patch("core.signals.photo_published.send")
+    def test_publish_photo_publishes_when_due(self, mock_pub):
+        photo = Photo.objects.create(title="Due", publish_date=timezone.now() + timedelta(days=7))
+        due = timezone.now() - timedelta(seconds=1)
+        Photo.objects.filter(pk=photo.pk).update(publish_date=due)
+
+        tasks.publish_photo(photo.id, due.isoformat())
+
+        self.assertTrue(Photo.objects.get(pk=photo.pk).published)
+        mock_pub.assert_called_once()
+
+    def test_publish_photo_ignores_stale_or_hidden(self):
+        photo = Photo.objects.create(title="Moved", publish_date=timezone.now() - timedelta(seconds=1))
+        Photo.objects.filter(pk=photo.pk).update(_published=False)
+
+        self.assertEqual(tasks.publish_photo(photo.id, timezone.now().isoformat()), "Publish date changed, skipped.")
+        self.assertFalse(Photo.objects.get(pk=photo.pk).published)
+
+        Photo.objects.filter(pk=photo.pk).update(hidden=True)
+        tasks.publish_photo(photo.id, Photo.objects.get(pk=photo.pk).publish_date.isoformat())
+        self.assertFalse(Photo.objects.get(pk=photo.pk).published)
+
+    @mock.patch("core.tasks.publish_photo.apply_async")
+    def test_publish_photo_reschedules_when_early(self, mock_retry):
+        publish_date = timezone.now() + timedelta(days=7)
+        photo = Photo.objects.create(title="Early", publish_date=publish_date)
+
+        tasks.publish_photo(photo.id, publish_date.isoformat())
+
+        mock_retry.assert_called_once_with((photo.id, publish_date.isoformat()), eta=publish_date)
+        self.assertFalse(Photo.objects.get(pk=photo.pk).published)
+
+
 class TestMigrations(TestCase):
 
     @property
@@ -8,7 +8,9 @@ from .models import *
 from .forms import *
 from .tables import *
 from .mixins import CRUDGenericMixin
-from django.http import FileResponse, Http404
+from . import tasks
+from .serving import serve_photo_size, render_in_progress_response
+from django.http import Http404
 from django.urls import NoReverseMatch
 
 #region Photo
@@ -48,12 +50,12 @@ class PhotoImageView(DetailView):
         self.object = self.get_object()
         size = kwargs.get('size')
         try:
-            image_file = self.object.get_size(size).image
-        except (AttributeError, KeyError, FileNotFoundError):
+            photo_size = tasks.get_or_render_size(self.object, size)
+        except tasks.RenderInProgress:
+            return render_in_progress_response(tasks.LAZY_RENDER_RETRY_AFTER)
+        if not photo_size:
             raise Http404("Requested size not found.")
-        if not image_file or not hasattr(image_file, 'open'):
-            raise Http404("Image not available.")
-        return FileResponse(image_file.open('rb'), content_type='image/jpeg')
+        return serve_photo_size(request, photo_size, private=True)
 
 
 class PhotoCreateView(PhotoMixin, CreateView):
@@ -176,7 +178,7 @@ class SizeMixin(CRUDGenericMixin):
     object_type_name_plural = "Sizes"
     object_url_name_slug = "size"
     no_object_detail_page = True  # Sizes do not have a detail page
-    edit_disclaimer = "Creating or modifying any size will trigger a reprocessing of all photos that use this size. This may take some time depending on the number of photos and sizes involved."
+    edit_disclaimer = "Creating a size, or changing how it is rendered (dimensions, crop or encoder settings), will trigger a reprocessing of all photos for this size. This may take some time depending on the number of photos involved."
 
 
 class SizeListView(SizeMixin, SingleTableView):
@@ -184,6 +186,9 @@ class SizeListView(SizeMixin, SingleTableView):
     template_name = "generic_crud_list.html"
     table_class = SizeTable  # No table for sizes yet
 
+    def get_queryset(self):
+        return super().get_queryset().select_related("regeneration")
+
 
 class SizeCreateView(SizeMixin, CreateView):
     model = Size
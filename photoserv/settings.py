@@ -165,6 +165,50 @@ CELERY_RESULT_BACKEND = "django-db"
 CELERY_RESULT_EXTENDED = True
 CELERY_RESULT_EXPIRES = 604800
 
+# Queues, so bulk work never delays uploads:
+#   interactive - metadata and UI thumbnails for new uploads, and publishing
+#   sizes       - remaining sizes for new or changed photos
+#   bulk        - library-wide regeneration and maintenance
+#   integrations - web requests and plugins
+CELERY_TASK_DEFAULT_QUEUE = "interactive"
+CELERY_TASK_ROUTES = {
+    'core.tasks.post_photo_create': {'queue': 'interactive'},
+    'core.tasks.generate_photo_metadata': {'queue': 'interactive'},
+    'core.tasks.delete_files': {'queue': 'interactive'},
+    'core.tasks.publish_photo': {'queue': 'interactive'},
+    'core.tasks.publish_photos': {'queue': 'interactive'},
+    'core.tasks.post_photo_create_sizes': {'queue': 'sizes'},
+    'core.tasks.generate_sizes_for_photo': {'queue': 'sizes'},
+    'core.tasks.generate_sizes_for_photos': {'queue': 'bulk'},
+    'core.tasks.generate_photo_metadata_batch': {'queue': 'bulk'},
+    'core.tasks.generate_photo_sizes_for_size': {'queue': 'bulk'},
+    'core.tasks.regenerate_size_chunk': {'queue': 'bulk'},
+    'core.tasks.resume_size_regenerations': {'queue': 'bulk'},
+    'core.tasks.consistency': {'queue': 'bulk'},
+    'integration.tasks.*': {'queue': 'integrations'},
+}
+# Workers take one task at a time so a queued bulk backlog isn't prefetched
+CELERY_WORKER_PREFETCH_MULTIPLIER = 1
+
+# --- Photo Processing ---
+# Threads used to render the sizes of a single photo in parallel
+PHOTO_SIZE_RENDER_THREADS = max(1, int(os.getenv("PHOTO_SIZE_RENDER_THREADS", str(min(4, os.cpu_count() or 1)))))
+# Photos rendered per task when a size is regenerated across the library
+SIZE_REGENERATION_CHUNK_SIZE = int(os.getenv("SIZE_REGENERATION_CHUNK_SIZE", "50"))
+# Restart a size regeneration that has made no progress for this many seconds
+SIZE_REGENERATION_STALL_TIMEOUT = 60 * 15
+# Metadata extraction: "exiftool" reads everything with ExifTool; "pillow" reads standard
+# EXIF in-process and uses ExifTool only for what Pillow can't read
+METADATA_BACKEND = os.getenv("METADATA_BACKEND", "exiftool").strip().lower()
+# Render missing or stale sizes when first requested instead of across the whole library
+PHOTO_SIZE_LAZY_RENDERING = (os.environ.get("PHOTO_SIZE_LAZY_RENDERING", "false").strip().lower() == "true")
+# Store raws and renders by the hash of their content, so identical files are stored once
+CONTENT_DEDUPLICATION = (os.environ.get("CONTENT_DEDUPLICATION", "false").strip().lower() == "true")
+# Render every size of a new upload in its interactive task, from the same read of the raw as
+# its metadata and UI thumbnails, instead of handing the rest to the sizes queue. Suits
+# deployments where one worker serves both queues.
+INGEST_SINGLE_READ = (os.environ.get("INGEST_SINGLE_READ", "false").strip().lower() == "true")
+
 # --- Cache Configuration (use Redis for shared cache across workers) ---
 CACHES = {
     'default': {
@@ -179,9 +223,15 @@ CELERY_BEAT_SCHEDULE = {
         'task': 'core.tasks.consistency',
         'schedule': 60.0 * 60 * 2,
     },
+    'resume-size-regenerations': {
+        'task': 'core.tasks.resume_size_regenerations',
+        'schedule': 60.0 * 10,
+    },
+    # Photos are published by tasks scheduled for their publish date; this schedules
+    # those coming due and catches anything missed
     'publish-photos': {
         'task': 'core.tasks.publish_photos',
-        'schedule': 60.0 * 10 if not DEBUG else 30.0,
+        'schedule': 60.0 * 30 if not DEBUG else 30.0,
     },
     'integration-consistency': {
         'task': 'integration.tasks.consistency',
@@ -204,6 +254,11 @@ if IS_CONTAINER:
 else:
     MEDIA_ROOT = os.path.join(BASE_DIR, 'content')
 
+# Hand image downloads to nginx with X-Accel-Redirect instead of streaming them from Python.
+# The internal location must alias MEDIA_ROOT (see nginx.conf)
+IMAGE_X_ACCEL_REDIRECT = (os.environ.get("IMAGE_X_ACCEL_REDIRECT", "false").strip().lower() == "true")
+IMAGE_X_ACCEL_LOCATION = "/_protected_content/"
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.2/ref/settings/#default-auto-field
 
@@ -211,6 +266,9 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 # --- REST Framework Configuration ---
 
+# Seconds a verified API key skips re-hashing on later requests
+API_KEY_CACHE_TTL = 60
+
 REST_FRAMEWORK = {
     # Use Django's standard `django.contrib.auth` permissions,
     # or allow read-only access for unauthenticated users.
@@ -0,0 +1,41 @@
+from rest_framework.pagination import CursorPagination
+
+
+class OptionalCursorPagination(CursorPagination):
+    """
+    Cursor pagination that only applies when a request passes `cursor` or `page_size`.
+    Other requests get the full unpaginated list, as before pagination existed.
+    """
+    page_size = 100
+    page_size_query_param = "page_size"
+    max_page_size = 1000
+    ordering = ("id",)
+
+    def paginate_queryset(self, queryset, request, view=None):
+        params = request.query_params
+        if self.cursor_query_param not in params and self.page_size_query_param not in params:
+            return None
+        return super().paginate_queryset(queryset, request, view)
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            "oneOf": [super().get_paginated_response_schema(schema), schema],
+        }
+
+    def get_schema_operation_parameters(self, view):
+        parameters = super().get_schema_operation_parameters(view)
+        for parameter in parameters:
+            parameter["description"] += " Pass either to paginate; without them the full list is returned."
+        return parameters
+
+
+class PhotoPagination(OptionalCursorPagination):
+    ordering = ("publish_date", "id")
+
+
+class TagPagination(OptionalCursorPagination):
+    ordering = ("name", "id")
+
+
+class SizePagination(OptionalCursorPagination):
+    ordering = ("max_dimension", "id")
@@ -1,15 +1,36 @@
-from core.models import Photo, Size, Album, Tag, PhotoMetadata, PhotoTag, PhotoSize
+from core.models import Photo, Size, Album, Tag, PhotoMetadata, PhotoTag, PhotoSize, SizeRegeneration
+from django.db.models import Prefetch
 from rest_framework import serializers
 from drf_spectacular.utils import extend_schema_field
 
 
+def include_sizes(request) -> bool:
+    return bool(request) and request.query_params.get("include_sizes", "").lower() in ["1", "true", "yes"]
+
+
+def public_sizes_prefetch() -> Prefetch:
+    """Prefetch photos' public sizes into `public_sizes`, for the size serializers below."""
+    return Prefetch(
+        "sizes",
+        queryset=PhotoSize.objects.filter(size__public=True).select_related("size"),
+        to_attr="public_sizes",
+    )
+
+
+def get_public_sizes(photo):
+    if hasattr(photo, "public_sizes"):
+        return photo.public_sizes
+    return photo.sizes.filter(size__public=True).select_related("size")
+
+
 class PhotoSizeSerializer(serializers.ModelSerializer):
     uuid = serializers.UUIDField(source='size.uuid', read_only=True)
     slug = serializers.CharField(source='size.slug', read_only=True)
+    content_type = serializers.CharField(read_only=True)
 
     class Meta:
         model = PhotoSize
-        fields = ["uuid", "slug", "height", "width", "md5"]
+        fields = ["uuid", "slug", "height", "width", "md5", "content_type"]
 
 
 class PhotoMetadataSerializer(serializers.ModelSerializer):
@@ -35,17 +56,10 @@ class PhotoSummarySerializer(serializers.ModelSerializer):
 
     @extend_schema_field(PhotoSizeSerializer(many=True))
     def get_sizes(self, obj):
-        request = self.context.get("request")
-
-        include_sizes = False
-        if request:
-            include_sizes = request.query_params.get("include_sizes", "").lower() in ["1", "true", "yes"]
-
-        if not include_sizes:
+        if not include_sizes(self.context.get("request")):
             return []
 
-        public_sizes = obj.sizes.filter(size__public=True)
-        return PhotoSizeSerializer(public_sizes, many=True).data
+        return PhotoSizeSerializer(get_public_sizes(obj), many=True).data
 
     class Meta:
         model = Photo
@@ -63,7 +77,10 @@ class AlbumSerializer(serializers.ModelSerializer):
 
     @extend_schema_field(PhotoSummarySerializer(many=True))
     def get_photos(self, obj):
-        return PhotoSummarySerializer(obj.get_ordered_photos(public_only=True), many=True, context=self.context).data
+        photos = obj.get_ordered_photos(public_only=True)
+        if include_sizes(self.context.get("request")):
+            photos = photos.prefetch_related(public_sizes_prefetch())
+        return PhotoSummarySerializer(photos, many=True, context=self.context).data
     
     @extend_schema_field(AlbumSummarySerializer(allow_null=True))
     def get_parent(self, obj):
@@ -85,7 +102,10 @@ class TagSerializer(serializers.ModelSerializer):
 
     @extend_schema_field(PhotoSummarySerializer(many=True))
     def get_photos(self, obj):
-        return PhotoSummarySerializer(obj.photos.filter(_published=True), many=True, context=self.context).data
+        photos = obj.photos.filter(_published=True)
+        if include_sizes(self.context.get("request")):
+            photos = photos.prefetch_related(public_sizes_prefetch())
+        return PhotoSummarySerializer(photos, many=True, context=self.context).data
 
 
 class PhotoSerializer(serializers.ModelSerializer):
@@ -96,18 +116,33 @@ class PhotoSerializer(serializers.ModelSerializer):
 
     @extend_schema_field(PhotoSizeSerializer(many=True))
     def get_sizes(self, obj):
-        public_sizes = obj.sizes.filter(size__public=True)
-        return PhotoSizeSerializer(public_sizes, many=True).data
+        return PhotoSizeSerializer(get_public_sizes(obj), many=True).data
 
     class Meta:
         model = Photo
-        exclude = ['id', 'raw_image']
+        # Listed explicitly so new private fields (like the raw file and its hash) aren't exposed
+        fields = [
+            "metadata", "albums", "tags", "sizes", "uuid", "created_at", "updated_at",
+            "title", "slug", "description", "publish_date", "hidden", "_published",
+        ]
 
 
 class SizeSerializer(serializers.ModelSerializer):
     class Meta:
         model = Size
-        fields = ["uuid", "slug", "max_dimension", "square_crop", "created_at", "updated_at"]
+        fields = ["uuid", "slug", "max_dimension", "square_crop", "output_format", "created_at", "updated_at"]
+
+
+class SizeRegenerationSerializer(serializers.ModelSerializer):
+    slug = serializers.CharField(source='size.slug', read_only=True)
+    eta_seconds = serializers.SerializerMethodField()
+
+    class Meta:
+        model = SizeRegeneration
+        fields = ["slug", "done", "total", "started_at", "eta_seconds"]
+
+    def get_eta_seconds(self, obj) -> int | None:
+        return int(obj.eta.total_seconds()) if obj.eta is not None else None
 
 
 class SiteHealthSerializer(serializers.Serializer):
@@ -115,3 +150,4 @@ class SiteHealthSerializer(serializers.Serializer):
     photos_pending_sizes = serializers.IntegerField()
     pending_sizes = serializers.IntegerField()
     pending_metadata = serializers.IntegerField()
+    size_regenerations = SizeRegenerationSerializer(many=True)
@@ -3,8 +3,12 @@ from rest_framework.test import APIClient
 from rest_framework import status
 from django.core.files.uploadedfile import SimpleUploadedFile
 from core.models import *
+from core.tests import TempMediaTestCase
 from api_key.models import APIKey
 import io
+from unittest import mock
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
 from PIL import Image
 from django.utils import timezone
 from datetime import timedelta
@@ -139,6 +143,14 @@ class APISerializerTestCase(TestCase):
         self.assertIn(str(self.album1.uuid), album_uuids)
         self.assertIn(str(self.album2.uuid), album_uuids)
     
+    def test_photo_detail_hides_raw_file(self):
+        Photo.objects.filter(pk=self.photo.pk).update(raw_md5="0123456789abcdef0123456789abcdef")
+
+        data = self.client.get(f"/api/photos/{self.photo.uuid}/").json()
+
+        for field in ["id", "raw_image", "raw_md5"]:
+            self.assertNotIn(field, data)
+
     # --- Album detail API test ---
     def test_album_detail_returns_ordered_photos(self):
         url = f"/api/albums/{self.album1.uuid}/"
@@ -435,6 +447,19 @@ class APISiteHealthTestCase(TestCase):
         self.assertEqual(data["pending_sizes"], 3)
         self.assertEqual(data["photos_pending_sizes"], 2)
         self.assertEqual(data["pending_metadata"], 1)
+        self.assertEqual(data["size_regenerations"], [])
+
+    def test_site_health_reports_size_regenerations(self):
+        SizeRegeneration.objects.create(size=self.size_large, total=3, done=1)
+
+        response = self.client.get("/api/health/")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        regenerations = response.json()["size_regenerations"]
+        self.assertEqual(len(regenerations), 1)
+        self.assertEqual(regenerations[0]["slug"], "large")
+        self.assertEqual(regenerations[0]["done"], 1)
+        self.assertEqual(regenerations[0]["total"], 3)
 
 
 class TestIncludePhotoSummarySizes(TestCase):
@@ -523,4 +548,162 @@ class TestIncludePhotoSummarySizes(TestCase):
         for photo in response.json().get("photos", []):
             size_slugs = [s["slug"] for s in photo.get("sizes", [])]
             self.assertIn(self.public_size.slug, size_slugs)
-            self.assertNotIn(self.private_size.slug, size_slugs)
\ No newline at end of file
+            self.assertNotIn(self.private_size.slug, size_slugs)
+
+class APIPaginationTestCase(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.api_key = APIKey.create_key("pagination test key")
+        self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {self.api_key}")
+
+        now = timezone.now()
+        self.photos = []
+        for i in range(5):
+            photo = Photo.objects.create(
+                title=f"Paged {i}", raw_image="paged.jpg", publish_date=now - timedelta(days=5 - i)
+            )
+            photo.update_published(update_model=True)
+            self.photos.append(photo)
+
+    def collect(self, url):
+        uuids = []
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            uuids += [photo["uuid"] for photo in response.json()["results"]]
+            url = response.json()["next"]
+        return uuids
+
+    def test_unpaginated_without_params(self):
+        response = self.client.get("/api/photos/")
+        self.assertEqual(response.status_code, 200)
+        self.assertIsInstance(response.json(), list)
+        self.assertEqual(len(response.json()), 5)
+
+    def test_cursor_walks_photos_by_publish_date(self):
+        uuids = self.collect("/api/photos/?page_size=2")
+        self.assertEqual(uuids, [str(photo.uuid) for photo in self.photos])
+
+    def test_cursor_stable_across_inserts(self):
+        response = self.client.get("/api/photos/?page_size=2")
+        next_url = response.json()["next"]
+
+        # A photo published before the cursor position doesn't shift later pages
+        early = Photo.objects.create(title="Early", raw_image="early.jpg", publish_date=timezone.now() - timedelta(days=10))
+        early.update_published(update_model=True)
+
+        uuids = self.collect(next_url)
+        self.assertEqual(uuids, [str(photo.uuid) for photo in self.photos[2:]])
+
+    def test_page_size_capped(self):
+        with mock.patch("public_rest_api.pagination.OptionalCursorPagination.max_page_size", 3):
+            response = self.client.get("/api/photos/?page_size=100")
+        self.assertEqual(len(response.json()["results"]), 3)
+
+    def test_other_lists_paginate(self):
+        Tag.objects.create(name="a")
+        Tag.objects.create(name="b")
+        for url in ["/api/tags/?page_size=1", "/api/albums/?page_size=1", "/api/sizes/?page_size=1"]:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            self.assertIn("results", response.json())
+
+
+class APIQueryCountTestCase(TestCase):
+    """Endpoints run a fixed number of queries, however many photos they return."""
+
+    def setUp(self):
+        self.client = APIClient()
+        self.api_key = APIKey.create_key("query count test key")
+        self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {self.api_key}")
+
+        self.medium = Size.objects.create(slug="medium", max_dimension=50)
+        self.album = Album.objects.create(title="Counted")
+        self.tag = Tag.objects.create(name="counted")
+        self.photo_count = 0
+
+    def add_photos(self, count):
+        for _ in range(count):
+            self.photo_count += 1
+            photo = Photo.objects.create(title=f"Counted {self.photo_count}", raw_image="counted.jpg")
+            photo.update_published(update_model=True)
+            for size in Size.objects.all():
+                PhotoSize.objects.create(photo=photo, size=size, image=f"counted_{self.photo_count}_{size.slug}.jpg")
+            PhotoMetadata.objects.create(photo=photo, camera_make="Nikon")
+            photo.assign_albums([self.album])
+            PhotoTag.objects.create(photo=photo, tag=self.tag)
+        return photo
+
+    def count_queries(self, url):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return len(queries)
+
+    def assert_constant_queries(self, url_for):
+        photo = self.add_photos(2)
+        few = self.count_queries(url_for(photo))
+        photo = self.add_photos(5)
+        many = self.count_queries(url_for(photo))
+        self.assertEqual(few, many)
+
+    def test_photo_list(self):
+        self.assert_constant_queries(lambda photo: "/api/photos/?include_sizes=true")
+
+    def test_photo_detail(self):
+        self.assert_constant_queries(lambda photo: f"/api/photos/{photo.uuid}/")
+
+    def test_album_detail(self):
+        self.assert_constant_queries(lambda photo: f"/api/albums/{self.album.uuid}/?include_sizes=true")
+
+    def test_tag_detail(self):
+        self.assert_constant_queries(lambda photo: f"/api/tags/{self.tag.uuid}/?include_sizes=true")
+
+    def test_photo_detail_sizes_and_relations(self):
+        photo = self.add_photos(1)
+        data = self.client.get(f"/api/photos/{photo.uuid}/").json()
+
+        public_slugs = set(Size.objects.filter(public=True).values_list("slug", flat=True))
+        self.assertIn("medium", public_slugs)
+        self.assertEqual({size["slug"] for size in data["sizes"]}, public_slugs)
+        self.assertEqual(data["metadata"]["camera_make"], "Nikon")
+        self.assertEqual([album["uuid"] for album in data["albums"]], [str(self.album.uuid)])
+        self.assertEqual([tag["name"] for tag in data["tags"]], ["counted"])
+        self.assertNotIn("raw_md5", data)
+
+
+class APIImageCachingTestCase(TempMediaTestCase):
+    def setUp(self):
+        super().setUp()
+        self.client = APIClient()
+        self.api_key = APIKey.create_key("caching test key")
+        self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {self.api_key}")
+
+        self.size = Size.objects.create(slug="cached", max_dimension=50, public=True)
+        self.photo = Photo.objects.create(title="Cached", raw_image=create_test_image_file())
+        self.photo.update_published(update_model=True)
+        self.photo_size = PhotoSize.objects.create(
+            photo=self.photo, size=self.size, image=create_test_image_file("cached.jpg"), md5="0123456789abcdef0123456789abcdef"
+        )
+        self.url = f"/api/photos/{self.photo.uuid}/sizes/{self.size.slug}/"
+
+    def test_plain_url_must_revalidate(self):
+        response = self.client.get(self.url)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response["Cache-Control"], "no-cache")
+        self.assertEqual(response["ETag"], f'"{self.photo_size.md5}"')
+
+    def test_hashed_url_is_immutable(self):
+        response = self.client.get(f"{self.url}{self.photo_size.md5}/")
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response["Cache-Control"], "public, max-age=31536000, immutable")
+
+    def test_outdated_hashed_url_is_404(self):
+        response = self.client.get(f"{self.url}ffffffffffffffffffffffffffffffff/")
+        self.assertEqual(response.status_code, 404)
+
+    def test_conditional_request_returns_304(self):
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=f'"{self.photo_size.md5}"')
+        self.assertEqual(response.status_code, 304)
@@ -11,5 +11,7 @@ router.register(r'albums', AlbumViewSet, basename='album')
 urlpatterns = [
     path("", include((router.urls, "api"), namespace="api")),
     path("photos/<uuid:uuid>/sizes/<slug:size>/", PhotoImageAPIView.as_view(), name="photo-image"),
+    # Content-hashed variant (md5 from the photo's sizes), served as immutable
+    path("photos/<uuid:uuid>/sizes/<slug:size>/<str:md5>/", PhotoImageAPIView.as_view(), name="photo-image-hashed"),
     path("health/", SiteHealthAPIView.as_view(), name="site-health"),
 ]
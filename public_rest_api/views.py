@@ -1,13 +1,16 @@
 from rest_framework import viewsets
 from core.models import Photo, Size
+from core.serving import serve_photo_size, render_in_progress_response
+from core.tasks import get_or_render_size, RenderInProgress, LAZY_RENDER_RETRY_AFTER
 from .serializers import *
-from django.http import FileResponse, Http404
+from django.http import Http404
 from rest_framework.generics import GenericAPIView
 from api_key.authentication import APIKeyAuthentication
 from api_key.permissions import HasAPIKey
 from rest_framework.response import Response
 from drf_spectacular.utils import OpenApiParameter, OpenApiTypes, extend_schema
 from .models import *
+from .pagination import OptionalCursorPagination, PhotoPagination, SizePagination, TagPagination
 
 
 INCLUDE_SIZES_PARAM = OpenApiParameter(
@@ -23,6 +26,7 @@ class SizeViewSet(viewsets.ReadOnlyModelViewSet):
     authentication_classes = [APIKeyAuthentication]
     permission_classes = [HasAPIKey]
     serializer_class = SizeSerializer
+    pagination_class = SizePagination
     lookup_field = 'slug'
     queryset = Size.objects.filter(public=True)
 
@@ -31,12 +35,21 @@ class PhotoViewSet(viewsets.ReadOnlyModelViewSet):
     authentication_classes = [APIKeyAuthentication]
     permission_classes = [HasAPIKey]
     lookup_field = 'uuid'
+    pagination_class = PhotoPagination
     queryset = Photo.objects.filter(_published=True)
 
     def get_serializer_class(self):
         if self.action == 'list':
             return PhotoSummarySerializer
         return PhotoSerializer
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        if self.action == 'list':
+            if include_sizes(self.request):
+                queryset = queryset.prefetch_related(public_sizes_prefetch())
+            return queryset
+        return queryset.select_related("metadata").prefetch_related("albums", "tags", public_sizes_prefetch())
     
     @extend_schema(
         parameters=[INCLUDE_SIZES_PARAM],
@@ -46,6 +59,7 @@ class PhotoViewSet(viewsets.ReadOnlyModelViewSet):
         """
         List public photos.
         Optionally include sizes with ?include_sizes=true.
+        Paginate by publish date with ?page_size=<n>, then follow the `next` cursor.
         """
         return super().list(request, *args, **kwargs)
 
@@ -56,20 +70,28 @@ class PhotoImageAPIView(GenericAPIView):
     queryset = Photo.objects.filter(_published=True)
     lookup_field = "uuid"
 
-    def get(self, request, uuid, size, *args, **kwargs):
+    def get(self, request, uuid, size, md5=None, *args, **kwargs):
         photo = self.get_object()  # GenericAPIView uses queryset + lookup_field
-        photo_size = photo.get_size(size)
+        try:
+            photo_size = get_or_render_size(photo, size, public_only=True)
+        except RenderInProgress:
+            return render_in_progress_response(LAZY_RENDER_RETRY_AFTER)
 
-        if not photo_size or not hasattr(photo_size.image, "open") or not photo_size.size.public:
+        if not photo_size or not photo_size.size.public:
             raise Http404("Requested size not found.")
 
-        return FileResponse(photo_size.image.open("rb"), content_type="image/jpeg")
+        # Hashed URLs only ever serve the bytes they name, so they can be cached forever
+        if md5 is not None and md5 != photo_size.md5:
+            raise Http404("Requested size has changed.")
+
+        return serve_photo_size(request, photo_size, immutable=md5 is not None)
 
 
 class TagViewSet(viewsets.ReadOnlyModelViewSet):
     authentication_classes = [APIKeyAuthentication]
     permission_classes = [HasAPIKey]
     lookup_field = 'uuid'
+    pagination_class = TagPagination
     queryset = Tag.objects.all()
 
     def get_serializer_class(self):
@@ -93,7 +115,8 @@ class AlbumViewSet(viewsets.ReadOnlyModelViewSet):
     authentication_classes = [APIKeyAuthentication]
     permission_classes = [HasAPIKey]
     lookup_field = 'uuid'
-    queryset = Album.objects.all()
+    pagination_class = OptionalCursorPagination
+    queryset = Album.objects.select_related("parent")
 
     def get_serializer_class(self):
         if self.action == 'list':
@@ -118,7 +141,7 @@ class SiteHealthAPIView(GenericAPIView):
     serializer_class = SiteHealthSerializer
 
     def get(self, request, *args, **kwargs):
-        from core.models import Photo, PhotoSize
+        from core.models import Photo, PhotoSize, SizeRegeneration
 
         total_photos = Photo.objects.count()
         total_sizes = Size.objects.count()
@@ -136,11 +159,14 @@ class SiteHealthAPIView(GenericAPIView):
         photos_pending_sizes = total_photos - photos_with_all_sizes
         pending_metadata = Photo.objects.filter(metadata__isnull=True).count()
 
+        size_regenerations = SizeRegeneration.objects.filter(finished_at__isnull=True).select_related("size")
+
         site_health = SiteHealth(
             total_photos=total_photos,
             photos_pending_sizes=photos_pending_sizes,
             pending_sizes=pending_sizes,
             pending_metadata=pending_metadata,
+            size_regenerations=size_regenerations,
         )
 
         serializer = SiteHealthSerializer(site_health)